@@ -0,0 +1,1148 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import pickle
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+from array import array
+from functools import partial
+from itertools import count, repeat, starmap
+from multiprocessing import AuthenticationError, Pool, Process, SimpleQueue
+from multiprocessing.connection import Client, Listener
+from operator import neg, sub
+
+try:
+    import numpy
+except ImportError:
+    # only whole chunks of variates need it, see RandomStream.exponentials
+    numpy = None
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is then not reported
+    resource = None
+
+
+# random stream
+# random variates drawn in blocks from a seedable generator; spawned streams
+# are independent of each other and reproducible from the parent seed, and
+# vectorized engines draw whole chunks as numpy arrays from a numpy
+# generator seeded by the stream on first use
+class RandomStream:
+    BLOCK_SIZE = 4096
+
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        self.__random = random.Random(seed)
+        self.__block_size = block_size
+        # blocks are typed arrays, 8 bytes per pending variate
+        self.__uniforms = array("d")
+        self.__exponentials = array("d")
+        self.__generator = None
+
+    def __draw_uniforms(self, count):
+        return starmap(self.__random.random, repeat((), count))
+
+    def __draw_exponentials(self, count):
+        # -log(1 - U) is a standard exponential variate
+        return map(neg, map(math.log, map(
+            sub, repeat(1.0), self.__draw_uniforms(count))))
+
+    def spawn(self, block_size=None):
+        return RandomStream(self.__random.getrandbits(128),
+                            block_size or self.__block_size)
+
+    def random(self):
+        if not self.__uniforms:
+            self.__uniforms = array(
+                "d", self.__draw_uniforms(self.__block_size))
+
+        return self.__uniforms.pop()
+
+    def randbelow(self, n):
+        return int(self.random() * n)
+
+    def exponential(self, lambda_):
+        if not self.__exponentials:
+            self.__exponentials = array(
+                "d", self.__draw_exponentials(self.__block_size))
+
+        return self.__exponentials.pop()/lambda_
+
+    def __chunk_generator(self):
+        if self.__generator is None:
+            self.__generator = numpy.random.default_rng(
+                self.__random.getrandbits(128))
+
+        return self.__generator
+
+    def uniforms(self, count):
+        return self.__chunk_generator().random(count)
+
+    def exponentials(self, lambda_, count):
+        return self.__chunk_generator().standard_exponential(count) / lambda_
+
+
+# trace
+# binary traces are flat little-endian float64 records of column_num values
+# sorted by time; a column is read through mmap one chunk of records at a
+# time, so a trace of any size streams through a small window and the page
+# cache, and a pickled column reopens its file where it stopped
+class TraceColumn:
+    CHUNK_RECORDS = 65536
+
+    def __init__(self, path, column, column_num, position=0):
+        self.__path = path
+        self.__column = column
+        self.__column_num = column_num
+        # record of the next value
+        self.__position = position
+        self.__chunk = array("d")
+        self.__chunk_index = 0
+
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self.__record_num = size // (8 * column_num)
+            # the mapping stays valid after the file is closed
+            self.__mmap = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __getstate__(self):
+        return {"path": self.__path, "column": self.__column,
+                "column_num": self.__column_num, "position": self.__position}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __load_chunk(self):
+        record_size = 8 * self.__column_num
+        end = min(self.__position + TraceColumn.CHUNK_RECORDS,
+                  self.__record_num)
+        values = array("d")
+        values.frombytes(
+            self.__mmap[self.__position * record_size:end * record_size])
+
+        if sys.byteorder == "big":
+            values.byteswap()
+
+        self.__chunk = values[self.__column::self.__column_num]
+        self.__chunk_index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__chunk_index >= len(self.__chunk):
+            if self.__position >= self.__record_num:
+                raise StopIteration
+
+            self.__load_chunk()
+
+        value = self.__chunk[self.__chunk_index]
+        self.__chunk_index += 1
+        self.__position += 1
+
+        return value
+
+
+# channel
+# records flow from the workers to the parent over one SimpleQueue: a put
+# pickles the record and writes it to the pipe directly, with no manager
+# process in between, but the queue lock serializes the writes of all
+# workers; only the parent touches the console and the log file
+channel = None
+
+
+def init_worker(queue):
+    global channel
+    channel = queue
+
+
+def emit(event, job, **fields):
+    record = dict(fields, event=event, job=job,
+                  pid=os.getpid(), time=time.time())
+
+    if channel is not None:
+        channel.put(record)
+    elif event == "result":
+        # run outside of a sweep
+        print(record["report"])
+
+
+def handle_record(record, log_file=None):
+    if log_file is not None:
+        log_file.write(json.dumps(record) + "\n")
+        log_file.flush()
+
+    if record["event"] == "result":
+        print(record["report"])
+    elif record["event"] == "progress":
+        str = (
+            "Progress of %s: %5.1f%% of sim time, %.0f events/s\n"
+        ) % (", ".join("%s=%s" % item for item in sorted(
+            record["job"].items())), 100.0 * record["sim_time_fraction"],
+            record["events_per_second"])
+        print(str)
+
+
+# sweep
+# runs every point of a parameter grid on one pool sized to the machine;
+# points are submitted longest first, idle workers pick up whatever is
+# queued next, and every point gets independent replications until the
+# confidence intervals of its metrics are narrow enough
+class Sweep:
+    # two-sided 95% Student t quantiles by degrees of freedom
+    __T_QUANTILES = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571,
+                     6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+                     12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+    __Z_QUANTILE = 1.96
+
+    def __init__(self, run_point, points, estimate_cost, ci_metrics,
+                 processes=None, seed=None, min_replications=1,
+                 max_replications=1, ci_width=None, cache=None,
+                 handle_record=None, handle_replication=None,
+                 common_random_numbers=False, coordinator=None):
+        self.__run_point = run_point
+        self.__points = points
+        self.__estimate_cost = estimate_cost
+        self.__ci_metrics = ci_metrics
+        self.__processes = processes or os.cpu_count()
+        # common random numbers: every point of a replication runs on the
+        # same streams, so differences between points are not drowned in
+        # sampling noise; a base seed is needed to share them
+        self.__common_random_numbers = common_random_numbers
+
+        if common_random_numbers and seed is None:
+            seed = random.getrandbits(64)
+
+        self.__seed = seed
+        self.__min_replications = min_replications
+        self.__max_replications = max(min_replications, max_replications)
+        # target half-width of the confidence intervals, relative to the mean
+        self.__ci_width = ci_width
+        self.__cache = cache
+        # called in the parent with every record the workers emit
+        self.__handle_record = handle_record or (lambda record: None)
+        # called in the parent with the point, the replication index and the
+        # metrics of every finished replication, cached or not
+        self.__handle_replication = handle_replication or (
+            lambda point, replication, metrics: None)
+        # serves the jobs to remote workers instead of a local pool
+        self.__coordinator = coordinator
+
+    @staticmethod
+    def __calculate_ci(values):
+        if len(values) < 2:
+            return math.inf
+
+        df = len(values) - 1
+        t = Sweep.__Z_QUANTILE
+
+        for quantile_df, quantile in Sweep.__T_QUANTILES.items():
+            if quantile_df <= df:
+                t = quantile
+
+        if df > max(Sweep.__T_QUANTILES):
+            t = Sweep.__Z_QUANTILE
+
+        return t * statistics.stdev(values) / math.sqrt(len(values))
+
+    def __replication_seed(self, point, replication):
+        # derived from the point itself so that it does not depend on the
+        # grid or on the completion order
+        if self.__seed is None:
+            return None
+
+        if self.__common_random_numbers:
+            return "%s:%d" % (self.__seed, replication)
+
+        return "%s:%s:%d" % (self.__seed, sorted(point.items()), replication)
+
+    def __is_converged(self, metrics_list):
+        if len(metrics_list) < self.__min_replications:
+            return False
+
+        if self.__ci_width is None:
+            return True
+
+        for metric in self.__ci_metrics:
+            values = [metrics[metric] for metrics in metrics_list]
+
+            if Sweep.__calculate_ci(values) > \
+                    self.__ci_width * abs(statistics.fmean(values)):
+                return False
+
+        return True
+
+    def __aggregate(self, point, metrics_list):
+        row = dict(metrics_list[0])
+
+        for key, value in row.items():
+            if key not in point and isinstance(value, (int, float)) \
+                    and not isinstance(value, bool):
+                row[key] = statistics.fmean(
+                    metrics[key] for metrics in metrics_list)
+
+        for metric in self.__ci_metrics:
+            row[metric + "_ci"] = Sweep.__calculate_ci(
+                [metrics[metric] for metrics in metrics_list])
+
+        row["replications"] = len(metrics_list)
+
+        return row
+
+    def run(self):
+        finished = queue.Queue()
+        metrics_lists = [[] for _ in self.__points]
+        submitted = [0] * len(self.__points)
+        records = SimpleQueue()
+
+        if self.__coordinator is not None:
+            pool = self.__coordinator
+            pool.serve(records)
+        else:
+            pool = Pool(self.__processes, initializer=init_worker,
+                        initargs=(records,))
+
+        def consume():
+            # a None record is the parent's own end marker
+            for record in iter(records.get, None):
+                self.__handle_record(record)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+
+        def submit(index):
+            kwargs = dict(self.__points[index])
+            kwargs["seed"] = self.__replication_seed(
+                self.__points[index], submitted[index])
+            submitted[index] += 1
+
+            # replications already in the cache skip the pool, so a grid can
+            # be extended one point or one replication at a time
+            metrics = self.__cache.get(
+                kwargs) if self.__cache is not None else None
+
+            if metrics is not None:
+                finished.put((index, metrics))
+                return
+
+            def store(metrics):
+                if self.__cache is not None:
+                    self.__cache.put(kwargs, metrics)
+
+                finished.put((index, metrics))
+
+            pool.apply_async(self.__run_point, (), kwargs, callback=store,
+                             error_callback=lambda error: finished.put(
+                                 (index, error)))
+
+        # longest jobs first so that the slowest point does not start last
+        order = sorted(range(len(self.__points)), key=lambda index:
+                       -self.__estimate_cost(self.__points[index]))
+
+        for index in order:
+            for _ in range(self.__min_replications):
+                submit(index)
+
+        pending = len(order) * self.__min_replications
+
+        try:
+            while pending > 0:
+                index, metrics = finished.get()
+                pending -= 1
+
+                if isinstance(metrics, BaseException):
+                    raise metrics
+
+                metrics_lists[index].append(metrics)
+                self.__handle_replication(
+                    self.__points[index], len(metrics_lists[index]) - 1,
+                    metrics)
+
+                if submitted[index] == len(metrics_lists[index]) \
+                        and submitted[index] < self.__max_replications \
+                        and not self.__is_converged(metrics_lists[index]):
+                    submit(index)
+                    pending += 1
+        finally:
+            pool.terminate()
+            pool.join()
+            records.put(None)
+            consumer.join()
+
+        return [self.__aggregate(point, metrics_list) for point, metrics_list
+                in zip(self.__points, metrics_lists)]
+
+
+# checkpointed run
+# a checkpoint is a pickled snapshot of the event loop state tagged with the
+# engine version and the sim_time it reached; a run advances in segments up
+# to the next checkpoint or progress deadline, whichever comes first
+def checkpoint_file(checkpoint_dir, key):
+    # one checkpoint per run, independent of sim_time so that a longer
+    # sim_time picks up where the last run stopped
+    key = json.dumps(key, sort_keys=True, default=repr)
+
+    return os.path.join(checkpoint_dir,
+                        hashlib.sha256(key.encode()).hexdigest()
+                        + ".checkpoint")
+
+
+class CheckpointVersionError(ValueError):
+    # the checkpoint was written by another engine, a fresh run replaces it
+    pass
+
+
+class CheckpointRangeError(ValueError):
+    # the checkpoint cannot be continued to the sim_time asked for, it is
+    # kept and that sim_time runs from a checkpoint of its own
+    pass
+
+
+def load_checkpoint(checkpoint_path, engine_version, sim_time=None):
+    # returns the checkpoint and the sim_time to continue it to
+    with open(checkpoint_path, "rb") as file:
+        checkpoint = pickle.load(file)
+
+    if checkpoint["engine_version"] != engine_version:
+        raise CheckpointVersionError("checkpoint of another engine version")
+
+    if sim_time is None:
+        sim_time = checkpoint["sim_time"]
+    elif sim_time < checkpoint["sim_time"]:
+        raise CheckpointRangeError("checkpoint is past sim_time")
+
+    return checkpoint, sim_time
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    temp_path = "%s.%d.tmp" % (checkpoint_path, os.getpid())
+
+    with open(temp_path, "wb") as file:
+        pickle.dump(checkpoint, file, pickle.HIGHEST_PROTOCOL)
+
+    # never leave a torn checkpoint behind if the process dies here
+    os.replace(temp_path, checkpoint_path)
+
+
+def resume_run(resume, start, checkpoint_dir, key, sim_time,
+               checkpoint_interval=None, **options):
+    # continue the checkpoint of the run if there is one, or start it; any
+    # other error is the caller's, a checkpoint is never silently replaced
+    checkpoint_path = checkpoint_file(checkpoint_dir, key)
+
+    try:
+        return resume(checkpoint_path, sim_time, checkpoint_interval,
+                      **options)
+    except (FileNotFoundError, CheckpointVersionError):
+        pass
+    except CheckpointRangeError:
+        # a shorter sim_time, or one past the horizon of a trace, keeps the
+        # longer checkpoint and uses one named after its own sim_time
+        checkpoint_path = checkpoint_file(checkpoint_dir, [key, sim_time])
+
+        try:
+            return resume(checkpoint_path, sim_time, checkpoint_interval,
+                          **options)
+        except (FileNotFoundError, CheckpointVersionError):
+            pass
+
+    return start(checkpoint_path=checkpoint_path,
+                 checkpoint_interval=checkpoint_interval, **options)
+
+
+class RunControl:
+    def __init__(self, sim_time, count_events, save=None,
+                 checkpoint_interval=None, progress_callback=None,
+                 progress_interval=None):
+        self.__sim_time = sim_time
+        # events processed so far in a state, for the progress reports
+        self.__count_events = count_events
+        # saves a state as a checkpoint, None for a run without one
+        self.__save = save
+        # wall-clock seconds between checkpoints, None saves only at the end
+        self.__checkpoint_interval = math.inf if checkpoint_interval is None \
+            else checkpoint_interval
+        # called with the sim-time fraction and the event rate every
+        # progress_interval wall-clock seconds
+        self.__progress_callback = progress_callback
+        self.__progress_interval = math.inf if progress_callback is None \
+            or progress_interval is None else progress_interval
+        # wall-clock seconds spent in each phase of the last run
+        self.__phase_times = {}
+        self.counter_events = 0
+        # wall-clock start and event count of the event loop, set on its
+        # first segment
+        self.__segments_start = None
+
+    def record_phase(self, phase, phase_start_time):
+        phase_end_time = time.perf_counter()
+        self.__phase_times[phase] = phase_end_time - phase_start_time
+
+        return phase_end_time
+
+    @property
+    def profile(self):
+        return {"counter_events": self.counter_events,
+                "phase_times": dict(self.__phase_times)}
+
+    def run_segments(self, advance, state, end_time=None):
+        # advance returns True once end_time (sim_time by default) is
+        # reached, or False when the deadline passed first; the deadlines
+        # carry over between calls for consecutive batches
+        if end_time is None:
+            end_time = self.__sim_time
+
+        if self.__segments_start is None:
+            start_time = time.time()
+            self.__segments_start = (start_time, self.__count_events(state))
+            self.__next_checkpoint_time = start_time + \
+                self.__checkpoint_interval
+            self.__next_progress_time = start_time + self.__progress_interval
+
+        start_time, start_events = self.__segments_start
+
+        while True:
+            is_finished = advance(state, min(
+                self.__next_checkpoint_time, self.__next_progress_time),
+                end_time)
+            current_time = time.time()
+
+            if self.__save is not None and (
+                    is_finished and end_time == self.__sim_time
+                    or current_time >= self.__next_checkpoint_time):
+                self.__save(state)
+                self.__next_checkpoint_time = current_time + \
+                    self.__checkpoint_interval
+
+            # a batch that ends short of sim_time reports progress too, else
+            # a run of short batches would never report
+            if current_time >= self.__next_progress_time and not (
+                    is_finished and end_time == self.__sim_time):
+                self.__progress_callback(
+                    sim_time_fraction=min(
+                        state["clock"] / self.__sim_time, 1.0),
+                    events_per_second=(self.__count_events(
+                        state) - start_events) / (current_time - start_time))
+                self.__next_progress_time = current_time + \
+                    self.__progress_interval
+
+            if is_finished:
+                return
+
+
+# distributed sweep
+# a coordinator serves the jobs of a sweep over TCP instead of a local pool;
+# workers on any host connect, pull one job at a time and stream its records
+# and its result back, and the job of a worker that disconnects or stops
+# sending heartbeats is queued again ahead of the jobs not started yet
+WORKER_HEARTBEAT_INTERVAL = 5.0
+WORKER_TIMEOUT = 30.0
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+
+    return (host or "localhost", int(port))
+
+
+class Coordinator:
+    def __init__(self, address, authkey):
+        self.__listener = Listener(address, authkey=authkey)
+        # jobs by submission order, a retried job keeps its place
+        self.__jobs = queue.PriorityQueue()
+        self.__sequence = count()
+        self.__records = None
+        self.__is_terminated = False
+        self.__threads = []
+
+    @property
+    def address(self):
+        return self.__listener.address
+
+    def __accept(self):
+        while not self.__is_terminated:
+            try:
+                connection = self.__listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+
+            thread = threading.Thread(
+                target=self.__serve_worker, args=(connection,), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def __run_job(self, connection, job):
+        func, args, kwds, callback, error_callback = job
+        connection.send((func, args, kwds))
+        last_message_time = time.time()
+
+        while not self.__is_terminated:
+            if not connection.poll(WORKER_HEARTBEAT_INTERVAL):
+                if time.time() - last_message_time > WORKER_TIMEOUT:
+                    raise TimeoutError("worker stopped sending heartbeats")
+
+                continue
+
+            message = connection.recv()
+            last_message_time = time.time()
+
+            if message[0] == "record":
+                self.__records.put(message[1])
+            elif message[0] == "result":
+                callback(message[1])
+                return
+            elif message[0] == "error":
+                error_callback(message[1])
+                return
+
+    def __serve_worker(self, connection):
+        with connection:
+            while True:
+                sequence, job = self.__jobs.get()
+
+                # the end marker is passed on to the other workers
+                if job is None:
+                    self.__jobs.put((sequence, job))
+
+                    try:
+                        connection.send(None)
+                    except OSError:
+                        pass
+
+                    return
+
+                try:
+                    self.__run_job(connection, job)
+                except (OSError, EOFError):
+                    # the worker is gone, the next free one runs the job
+                    self.__jobs.put((sequence, job))
+                    return
+
+    def serve(self, records):
+        # records of remote jobs join the queue of the local ones
+        self.__records = records
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def apply_async(self, func, args=(), kwds={}, callback=None,
+                    error_callback=None):
+        self.__jobs.put((next(self.__sequence),
+                        (func, args, kwds, callback, error_callback)))
+
+    def terminate(self):
+        self.__is_terminated = True
+        self.__jobs.put((-1, None))
+        self.__listener.close()
+
+    def join(self):
+        for thread in self.__threads:
+            thread.join()
+
+
+# sends the records of a remote job to the coordinator, like the queue of a
+# local pool
+class WorkerChannel:
+    def __init__(self, send):
+        self.__send = send
+
+    def put(self, record):
+        self.__send(("record", record))
+
+
+def run_worker(address, authkey):
+    # wait for the coordinator to come up
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            time.sleep(1.0)
+
+    # jobs, records and heartbeats share the connection
+    lock = threading.Lock()
+    is_stopped = threading.Event()
+
+    def send(message):
+        with lock:
+            connection.send(message)
+
+    def heartbeat():
+        while not is_stopped.wait(WORKER_HEARTBEAT_INTERVAL):
+            try:
+                send(("heartbeat",))
+            except OSError:
+                return
+
+    init_worker(WorkerChannel(send))
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    with connection:
+        try:
+            for job in iter(connection.recv, None):
+                func, args, kwds = job
+
+                try:
+                    message = ("result", func(*args, **kwds))
+                except Exception as error:
+                    message = ("error", error)
+
+                try:
+                    send(message)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    # an exception that cannot be pickled is sent as text
+                    send(("error", RuntimeError(repr(message[1]))))
+        except (OSError, EOFError):
+            # the coordinator is gone
+            pass
+        finally:
+            is_stopped.set()
+
+
+def start_workers(address, authkey, processes=None):
+    workers = [Process(target=run_worker, args=(address, authkey))
+               for _ in range(processes or os.cpu_count())]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+
+# result cache
+# on-disk memo of single replications, keyed by the engine version, the
+# simulation parameters and the seed; every entry is a small JSON file whose
+# modification time doubles as its last use for LRU eviction. Input files
+# enter the key by their contents, so a file replaced under the same path
+# never hits the results of the old one
+FILE_DIGEST_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    # sha256 streamed in chunks, a trace can be larger than memory
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for chunk in iter(partial(file.read, FILE_DIGEST_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, engine_version, context, max_bytes=None):
+        self.__directory = directory
+        self.__engine_version = engine_version
+        # parameters shared by every replication, e.g. sim_time
+        self.__context = context
+        self.__max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, params):
+        key = json.dumps({"engine_version": self.__engine_version,
+                          "context": self.__context, "params": params},
+                         sort_keys=True, default=repr)
+
+        return os.path.join(self.__directory,
+                            hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def __evict(self):
+        entries = []
+
+        with os.scandir(self.__directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.__max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_bytes -= size
+
+    def get(self, params):
+        # unseeded runs are not reproducible and never cached
+        if params.get("seed") is None:
+            return None
+
+        path = self.__path(params)
+
+        try:
+            with open(path) as file:
+                metrics = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        os.utime(path)
+
+        return metrics
+
+    def put(self, params, metrics):
+        if params.get("seed") is None:
+            return
+
+        path = self.__path(params)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+
+        with open(temp_path, "w") as file:
+            json.dump(metrics, file)
+
+        os.replace(temp_path, path)
+
+        if self.__max_bytes is not None:
+            self.__evict()
+
+
+# columnar writer
+# append-only binary output, one raw native float64 file per column that
+# numpy.memmap or mmap can map directly; list-valued metrics such as
+# histograms go to a flat values file plus an int64 file of row end offsets,
+# and schema.json only counts rows whose columns are fully flushed; a key
+# first seen in a later row becomes a new column, NaN or empty before it
+class ColumnarWriter:
+    def __init__(self, directory):
+        self.__directory = directory
+        self.__schema_path = os.path.join(directory, "schema.json")
+        self.__files = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+        # appending to an existing output keeps its columns
+        try:
+            with open(self.__schema_path) as file:
+                self.__schema = json.load(file)
+        except FileNotFoundError:
+            self.__schema = {"byteorder": sys.byteorder,
+                             "rows": 0, "columns": {}}
+
+        # a run that died mid-append may have written past the last counted
+        # row, which would shift every row appended from now on
+        rows = self.__schema["rows"]
+
+        for column in self.__schema["columns"].values():
+            if "offsets" in column:
+                self.__truncate(column["file"], column["length"])
+                self.__truncate(column["offsets"], rows)
+            else:
+                self.__truncate(column["file"], rows)
+
+    def __truncate(self, filename, records):
+        path = os.path.join(self.__directory, filename)
+
+        if os.path.exists(path) and os.path.getsize(path) > 8 * records:
+            os.truncate(path, 8 * records)
+
+    def __add_column(self, name, value):
+        if isinstance(value, (bool, int, float)):
+            column = {"file": name + ".f64", "dtype": "float64"}
+        elif isinstance(value, list):
+            column = {"file": name + ".f64", "dtype": "float64",
+                      "offsets": name + ".offsets.i64", "length": 0}
+        else:
+            return
+
+        # earlier rows get NaN or an empty list, and a file left behind by a
+        # run that died before saving the schema is overwritten
+        rows = self.__schema["rows"]
+
+        with open(os.path.join(self.__directory, column["file"]), "wb") as file:
+            if "offsets" not in column:
+                (array("d", [math.nan]) * rows).tofile(file)
+
+        if "offsets" in column:
+            with open(os.path.join(self.__directory, column["offsets"]),
+                      "wb") as file:
+                (array("q", [0]) * rows).tofile(file)
+
+        self.__schema["columns"][name] = column
+
+    def __open(self, filename):
+        if filename not in self.__files:
+            self.__files[filename] = open(
+                os.path.join(self.__directory, filename), "ab")
+
+        return self.__files[filename]
+
+    def __save_schema(self):
+        temp_path = "%s.%d.tmp" % (self.__schema_path, os.getpid())
+
+        with open(temp_path, "w") as file:
+            json.dump(self.__schema, file, indent=2)
+
+        os.replace(temp_path, self.__schema_path)
+
+    def append(self, row):
+        for name, value in row.items():
+            if name not in self.__schema["columns"]:
+                self.__add_column(name, value)
+
+        # columns missing from a row are written as NaN or an empty list
+        for name, column in self.__schema["columns"].items():
+            value = row.get(name)
+
+            if "offsets" in column:
+                values = array("d", value or [])
+                values.tofile(self.__open(column["file"]))
+                column["length"] += len(values)
+                array("q", [column["length"]]).tofile(
+                    self.__open(column["offsets"]))
+            else:
+                array("d", [math.nan if value is None else value]).tofile(
+                    self.__open(column["file"]))
+
+        for file in self.__files.values():
+            file.flush()
+
+        self.__schema["rows"] += 1
+        self.__save_schema()
+
+    def close(self):
+        for file in self.__files.values():
+            file.close()
+
+        self.__files = {}
+
+
+# benchmark
+# every workload runs alone in a fresh worker so that its peak RSS is its
+# own, and the events per second of a stored baseline flag inner loop
+# regressions; run(workload) builds and simulates one workload and returns
+# measure_benchmark of it. A single run of a workload varies by +-30% on a
+# busy machine, but noise only ever slows a run down, so each workload runs
+# several times, interleaved with the others, and keeps its fastest run.
+# Even the fastest runs of two sessions differ by up to 15% on a shared or
+# throttled machine, hence the 20% default tolerance; a quiet machine can
+# afford a tighter one
+def measure_benchmark(name, DES_instance, sim):
+    start_time = time.perf_counter()
+    sim()
+    wall_time = time.perf_counter() - start_time
+
+    profile = DES_instance.profile
+
+    return {
+        "name": name,
+        "counter_events": profile["counter_events"],
+        "wall_time": wall_time,
+        "events_per_second": profile["counter_events"] / wall_time,
+        "phase_times": profile["phase_times"],
+        # kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if resource is not None else None
+    }
+
+
+def run_benchmark(run, workloads, phases, engine_version, save_path=None,
+                  compare_path=None, tolerance=0.2, repeats=5):
+    with Pool(1, maxtasksperchild=1) as pool:
+        runs = pool.map(run, workloads * repeats, chunksize=1)
+
+    results = [max(runs[k::len(workloads)],
+                   key=lambda result: result["events_per_second"])
+               for k in range(len(workloads))]
+
+    str = ("%-32s %12s" + " %11s" * len(phases) + " %12s\n") % (
+        "Workload", "Events/s", *(phase.capitalize() for phase in phases),
+        "Peak RSS KB")
+
+    for result in results:
+        phase_times = result["phase_times"]
+        str += ("%-32s %12.0f" + " %10.3fs" * len(phases) + " %12s\n") % (
+            result["name"], result["events_per_second"],
+            *(phase_times.get(phase, 0.0) for phase in phases),
+            result["peak_rss"])
+
+    print(str)
+
+    if save_path is not None:
+        with open(save_path, "w") as file:
+            json.dump({"engine_version": engine_version,
+                      "results": results}, file, indent=2)
+
+    regressions = 0
+
+    if compare_path is not None:
+        with open(compare_path) as file:
+            baseline = {result["name"]: result
+                        for result in json.load(file)["results"]}
+
+        str = ""
+
+        for result in results:
+            if result["name"] not in baseline:
+                continue
+
+            baseline_result = baseline[result["name"]]
+            ratio = result["events_per_second"] / \
+                baseline_result["events_per_second"]
+
+            if ratio < 1.0 - tolerance:
+                status = "REGRESSION"
+                regressions += 1
+            else:
+                status = "ok"
+
+            # fixed seeds process the same events unless the results changed
+            if result["counter_events"] != baseline_result["counter_events"]:
+                status += ", events changed"
+
+            str += "%-32s %7.2fx %s\n" % (result["name"], ratio, status)
+
+        print(str)
+
+    return regressions
+
+
+# command line
+# the options every sweep shares, and the wiring of a sweep to its cache,
+# columnar output, log file, checkpoints and coordinator
+def add_sweep_arguments(parser):
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes, defaults to the CPU count")
+    parser.add_argument("--seed", default=None,
+                        help="base seed of the replications")
+    parser.add_argument("--common-random-numbers", action="store_true",
+                        help="run every point of a replication on the same "
+                        "random streams")
+    parser.add_argument("--min-replications", type=int, default=1)
+    parser.add_argument("--max-replications", type=int, default=1)
+    parser.add_argument("--ci-width", type=float, default=None,
+                        help="target 95%% CI half-width relative to the mean")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse seeded replications stored in this "
+                        "directory")
+    parser.add_argument("--cache-max-mb", type=float, default=None,
+                        help="evict least recently used results above this "
+                        "size")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="checkpoint every run here and resume or extend "
+                        "it on the next sweep")
+    parser.add_argument("--checkpoint-interval", type=float, default=None,
+                        help="wall-clock seconds between checkpoints of a run")
+    parser.add_argument("--columnar-dir", default=None,
+                        help="append every replication to columnar binary "
+                        "files here")
+    parser.add_argument("--log-file", default=None,
+                        help="append every worker record to this file as JSON "
+                        "lines")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="wall-clock seconds between progress reports of "
+                        "a run")
+    parser.add_argument("--coordinator", default=None,
+                        help="serve the sweep jobs to workers from this "
+                        "HOST:PORT instead of a local pool")
+    parser.add_argument("--worker", default=None,
+                        help="run jobs of the coordinator at this HOST:PORT "
+                        "with --processes workers")
+    parser.add_argument("--authkey", default=None,
+                        help="shared secret of the coordinator and its "
+                        "workers")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="run the benchmark workloads instead of the "
+                        "sweep")
+    parser.add_argument("--benchmark-save", default=None,
+                        help="store the benchmark results as a JSON baseline")
+    parser.add_argument("--benchmark-compare", default=None,
+                        help="compare the benchmark results with a JSON "
+                        "baseline")
+    parser.add_argument("--benchmark-tolerance", type=float, default=0.2,
+                        help="slowdown relative to the baseline reported as a "
+                        "regression")
+    parser.add_argument("--benchmark-repeats", type=int, default=5,
+                        help="runs of every workload, the fastest one counts")
+
+
+def start_service(parser, args, run, workloads, phases, engine_version):
+    # the benchmark and the remote workers take the place of the sweep;
+    # returns whether one of them ran
+    if args.benchmark:
+        regressions = run_benchmark(run, workloads, phases, engine_version,
+                                    args.benchmark_save,
+                                    args.benchmark_compare,
+                                    args.benchmark_tolerance,
+                                    args.benchmark_repeats)
+
+        if regressions:
+            raise SystemExit(1)
+
+        return True
+
+    if (args.coordinator is not None or args.worker is not None) \
+            and args.authkey is None:
+        parser.error("--coordinator and --worker need --authkey")
+
+    if args.worker is not None:
+        start_workers(parse_address(args.worker),
+                      args.authkey.encode(), args.processes)
+
+        return True
+
+    return False
+
+
+def run_sweep(args, run_point, points, estimate_cost, ci_metrics,
+              engine_version, context):
+    # context holds every fixed parameter of the runs that the cache key
+    # needs besides the point and the seed
+    cache = None
+    if args.cache_dir is not None:
+        cache = ResultCache(args.cache_dir, engine_version, context,
+                            max_bytes=None if args.cache_max_mb is None
+                            else int(args.cache_max_mb*1024*1024))
+
+    log_file = open(args.log_file, "a") if args.log_file is not None else None
+
+    handle_replication = None
+    if args.columnar_dir is not None:
+        columnar_writer = ColumnarWriter(args.columnar_dir)
+
+        def handle_replication(point, replication, metrics):
+            columnar_writer.append(
+                dict(point, replication=replication, **metrics))
+
+    if args.checkpoint_dir is not None:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        run_point = partial(run_point, checkpoint_dir=args.checkpoint_dir,
+                            checkpoint_interval=args.checkpoint_interval)
+
+    coordinator = None
+    if args.coordinator is not None:
+        coordinator = Coordinator(parse_address(
+            args.coordinator), args.authkey.encode())
+        print("Coordinator listening on %s:%d\n" % coordinator.address)
+
+    sweep = Sweep(partial(run_point, progress_interval=args.progress_interval),
+                  points, estimate_cost, ci_metrics,
+                  processes=args.processes, seed=args.seed,
+                  min_replications=args.min_replications,
+                  max_replications=args.max_replications,
+                  ci_width=args.ci_width, cache=cache,
+                  handle_record=partial(handle_record, log_file=log_file),
+                  handle_replication=handle_replication,
+                  common_random_numbers=args.common_random_numbers,
+                  coordinator=coordinator)
+    rows = sweep.run()
+
+    if log_file is not None:
+        log_file.close()
+
+    if args.columnar_dir is not None:
+        columnar_writer.close()
+
+    return rows
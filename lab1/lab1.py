@@ -1,12 +1,39 @@
+import argparse
 import csv
-import heapq
 import math
+import os
 import random
 import statistics
+import sys
 import time
+from array import array
+from collections import deque
 from datetime import datetime
 from functools import partial
-from multiprocessing import Manager, Pool
+from itertools import accumulate, islice
+from multiprocessing import Pool
+from operator import add, mul, sub
+
+try:
+    import numpy
+except ImportError:
+    # the Lindley engine falls back to the event engine without it
+    numpy = None
+
+# infrastructure shared by both labs: random streams, trace columns,
+# checkpointed runs, the sweep with its pool or coordinator, the result
+# cache, the columnar writer, the benchmark harness and the command line
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), os.pardir, "common"))
+from simulation import (RandomStream, RunControl, TraceColumn,  # noqa: E402
+                        add_sweep_arguments, emit, file_digest,
+                        load_checkpoint, measure_benchmark, resume_run,
+                        run_sweep, save_checkpoint, start_service)
+
+
+# bump whenever a change alters the numbers a seeded run produces, so that
+# cached results of the previous engines are never reused
+ENGINE_VERSION = 4
 
 
 def generate_random(lambda_):
@@ -33,37 +60,581 @@ def verify_generated_random(lambda_):
     print(str)
 
 
-class DES:
-    __EVENT_OBSERVER = "Observer"
-    __EVENT_ARRIVAL = "Arrival"
-    __EVENT_DEPARTURE = "Departure"
+# poisson process
+# event times up to end_time pulled one at a time; unlike a generator it can
+# be pickled, and the first time past the horizon is kept so that a later,
+# longer horizon carries on from it
+class PoissonProcess:
+    def __init__(self, random_stream, lambda_, end_time):
+        self.__random_stream = random_stream
+        self.__lambda = lambda_
+        self.__end_time = end_time
+        self.__next_time = random_stream.exponential(lambda_)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__next_time > self.__end_time:
+            raise StopIteration
+
+        event_time = self.__next_time
+        self.__next_time += self.__random_stream.exponential(self.__lambda)
+
+        return event_time
+
+    def extend_to(self, end_time):
+        self.__end_time = end_time
+
+
+# arrival process
+# the same as PoissonProcess, but the intervals come from the interval source
+# of any arrival process
+class ArrivalProcess:
+    def __init__(self, intervals, end_time):
+        self.__intervals = intervals
+        self.__end_time = end_time
+        self.__next_time = intervals.next_interval()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__next_time > self.__end_time:
+            raise StopIteration
+
+        event_time = self.__next_time
+        self.__next_time += self.__intervals.next_interval()
+
+        return event_time
+
+    def extend_to(self, end_time):
+        self.__end_time = end_time
+
+
+# packet length distributions
+# sample(random_stream) draws one packet length, mean is its expected value;
+# samples(random_stream, count, divisor) draws a numpy array of count of them
+# already divided, e.g. by the transmission rate into service times
+class ExponentialDistribution:
+    def __init__(self, mean):
+        self.__mean = mean
+
+    @property
+    def mean(self):
+        return self.__mean
+
+    def sample(self, random_stream):
+        return random_stream.exponential(1.0/self.__mean)
+
+    def samples(self, random_stream, count, divisor=1.0):
+        return random_stream.exponentials(divisor/self.__mean, count)
+
+
+class DeterministicDistribution:
+    def __init__(self, value):
+        self.__value = value
+
+    @property
+    def mean(self):
+        return self.__value
+
+    def sample(self, random_stream):
+        return self.__value
+
+    def samples(self, random_stream, count, divisor=1.0):
+        return numpy.full(count, self.__value/divisor)
+
+
+# any finite distribution, e.g. a bimodal one or the packet sizes of a
+# trace; Vose's alias method splits it into equally likely columns holding
+# at most two values, so a draw is one uniform whatever the number of values
+class EmpiricalDistribution:
+    def __init__(self, values, weights=None):
+        if weights is None:
+            weights = [1.0] * len(values)
+
+        total_weight = math.fsum(weights)
+        column_num = len(values)
+        self.__values = list(values)
+        self.__mean = math.fsum(map(mul, values, weights)) / total_weight
+        # a column keeps its own value below its threshold, its alias above
+        self.__thresholds = [1.0] * column_num
+        self.__aliases = list(values)
+
+        scaled_weights = [weight * column_num /
+                          total_weight for weight in weights]
+        small = [k for k in range(column_num) if scaled_weights[k] < 1.0]
+        large = [k for k in range(column_num) if scaled_weights[k] >= 1.0]
+
+        while small and large:
+            k = small.pop()
+            j = large[-1]
+            self.__thresholds[k] = scaled_weights[k]
+            self.__aliases[k] = values[j]
+            scaled_weights[j] -= 1.0 - scaled_weights[k]
+
+            if scaled_weights[j] < 1.0:
+                small.append(large.pop())
+
+    @staticmethod
+    def from_file(path):
+        # one packet length per line, optionally followed by its weight; a
+        # trace with one line per packet collapses to its distinct lengths
+        weights = {}
+
+        with open(path) as file:
+            for line in file:
+                fields = line.split("#")[0].split()
+
+                if fields:
+                    value = float(fields[0])
+                    weights[value] = weights.get(value, 0.0) + \
+                        (float(fields[1]) if len(fields) > 1 else 1.0)
+
+        return EmpiricalDistribution(list(weights), list(weights.values()))
+
+    @property
+    def mean(self):
+        return self.__mean
+
+    def sample(self, random_stream):
+        u = random_stream.random() * len(self.__values)
+        k = min(int(u), len(self.__values) - 1)
+
+        return self.__values[k] if u - k < self.__thresholds[k] \
+            else self.__aliases[k]
+
+    def samples(self, random_stream, count, divisor=1.0):
+        u = random_stream.uniforms(count) * len(self.__values)
+        k = numpy.minimum(u.astype(int), len(self.__values) - 1)
+
+        return numpy.where(u - k < numpy.array(self.__thresholds)[k],
+                           numpy.array(self.__values)[k],
+                           numpy.array(self.__aliases)[k]) / divisor
+
+
+# arrival processes
+# intervals(random_stream, lambda_) gives a picklable source of inter-arrival
+# intervals with a long-run arrival rate of lambda_, pulled one at a time or
+# a numpy array at a time
+class PoissonArrivals:
+    def intervals(self, random_stream, lambda_):
+        return PoissonIntervals(random_stream, lambda_)
+
+
+class PoissonIntervals:
+    def __init__(self, random_stream, lambda_):
+        self.__random_stream = random_stream
+        self.__lambda = lambda_
+
+    def next_interval(self):
+        return self.__random_stream.exponential(self.__lambda)
+
+    def next_intervals(self, count):
+        return self.__random_stream.exponentials(self.__lambda, count)
+
+
+# two-state Markov-modulated Poisson process for bursty traffic: on and off
+# periods last exponential times of mean on_time and off_time, arrivals come
+# at an on rate and at off_rate_ratio times it while off, and the on rate is
+# set so that the long-run rate is lambda_; a ratio of 0 is on-off traffic
+class MMPPArrivals:
+    def __init__(self, on_time, off_time, off_rate_ratio=0.0):
+        self.__on_time = on_time
+        self.__off_time = off_time
+        self.__off_rate_ratio = off_rate_ratio
+
+    def intervals(self, random_stream, lambda_):
+        on_rate = lambda_ * (self.__on_time + self.__off_time) / \
+            (self.__on_time + self.__off_rate_ratio * self.__off_time)
+
+        return MMPPIntervals(random_stream,
+                             [on_rate, self.__off_rate_ratio * on_rate],
+                             [self.__on_time, self.__off_time])
+
+
+class MMPPIntervals:
+    def __init__(self, random_stream, rates, sojourn_times):
+        self.__random_stream = random_stream
+        self.__rates = rates
+        self.__sojourn_times = sojourn_times
+        # start in the stationary phase distribution
+        self.__phase = 0 if random_stream.random() * sum(sojourn_times) \
+            < sojourn_times[0] else 1
+        self.__time_left = random_stream.exponential(
+            1.0/sojourn_times[self.__phase])
+
+    def next_interval(self):
+        # both phases are memoryless, so a gap cut short by a phase change
+        # is simply drawn again at the new rate
+        interval = 0.0
+
+        while True:
+            rate = self.__rates[self.__phase]
+            gap = self.__random_stream.exponential(
+                rate) if rate > 0.0 else math.inf
+
+            if gap < self.__time_left:
+                self.__time_left -= gap
+
+                return interval + gap
+
+            interval += self.__time_left
+            self.__phase = 1 - self.__phase
+            self.__time_left = self.__random_stream.exponential(
+                1.0/self.__sojourn_times[self.__phase])
+
+    def next_intervals(self, count):
+        return numpy.fromiter(
+            (self.next_interval() for _ in range(count)), float, count)
+
+
+# trace
+# binary traces hold (arrival time, packet length in bits) records sorted by
+# time, read one TraceColumn per field
+def summarize_trace(path, sim_time):
+    # packets and total length up to sim_time, in one streaming pass
+    packets = 0
+    total_length = 0.0
+
+    for arrival_time, packet_length in zip(TraceColumn(path, 0, 2),
+                                           TraceColumn(path, 1, 2)):
+        if arrival_time > sim_time:
+            break
+
+        packets += 1
+        total_length += packet_length
+
+    return {"packets": packets, "total_length": total_length}
+
+
+# arrival times of a trace as an arrival process, whatever lambda_ is
+class TraceArrivals:
+    def __init__(self, path):
+        self.__path = path
+
+    def intervals(self, random_stream, lambda_):
+        return TraceIntervals(TraceColumn(self.__path, 0, 2))
+
+
+class TraceIntervals:
+    def __init__(self, times):
+        self.__times = times
+        self.__last_time = 0.0
+
+    def next_interval(self):
+        # an exhausted trace has no next arrival
+        arrival_time = next(self.__times, math.inf)
+
+        if arrival_time == math.inf:
+            return math.inf
+
+        interval = arrival_time - self.__last_time
+        self.__last_time = arrival_time
+
+        return interval
 
-    def __init__(self, packet_length_avg, trans_rate, sim_time, buffer_size, rho):
+    def next_intervals(self, count):
+        arrival_times = numpy.fromiter(islice(self.__times, count), float)
+        intervals = numpy.diff(arrival_times, prepend=self.__last_time)
+
+        if len(arrival_times):
+            self.__last_time = arrival_times[-1].item()
+
+        if len(intervals) < count:
+            intervals = numpy.append(intervals, math.inf)
+
+        return intervals
+
+
+# packet lengths of a trace, one per arrival in trace order; unlike the
+# other distributions it has a position, saved along with a checkpoint
+class TraceDistribution:
+    def __init__(self, path, mean):
+        self.__lengths = TraceColumn(path, 1, 2)
+        self.__mean = mean
+
+    @property
+    def mean(self):
+        return self.__mean
+
+    def sample(self, random_stream):
+        return next(self.__lengths)
+
+    def samples(self, random_stream, count, divisor=1.0):
+        return numpy.fromiter(islice(self.__lengths, count), float) / divisor
+
+
+# running count, mean and variance (Welford) with an optional histogram, so
+# samples do not have to be kept around
+class OnlineStatistics:
+    def __init__(self, histogram_size=None):
+        self.__count = 0
+        self.__mean = 0.0
+        self.__m2 = 0.0
+        # the last bin collects every value >= histogram_size - 1
+        self.__histogram = [0] * histogram_size if histogram_size else None
+
+    def __merge(self, count, mean, m2):
+        total_count = self.__count + count
+        delta = mean - self.__mean
+
+        self.__mean += delta * count / total_count
+        self.__m2 += m2 + delta * delta * self.__count * count / total_count
+        self.__count = total_count
+
+    def __add_to_histogram(self, value, weight):
+        self.__histogram[min(value, len(self.__histogram) - 1)] += weight
+
+    def add(self, value, weight=1):
+        self.__count += weight
+        delta = value - self.__mean
+        self.__mean += delta * weight / self.__count
+        self.__m2 += delta * (value - self.__mean) * weight
+
+        if self.__histogram is not None:
+            self.__add_to_histogram(value, weight)
+
+    def merge(self, other):
+        # combine with statistics gathered separately, e.g. by another process
+        if other.__count == 0:
+            return
+
+        self.__merge(other.__count, other.__mean, other.__m2)
+
+        if self.__histogram is not None:
+            self.__histogram = list(
+                map(add, self.__histogram, other.__histogram))
+
+    @property
+    def count(self):
+        return self.__count
+
+    @property
+    def mean(self):
+        return self.__mean
+
+    @property
+    def variance(self):
+        return self.__m2 / self.__count if self.__count > 0 else 0.0
+
+    @property
+    def histogram(self):
+        return None if self.__histogram is None else list(self.__histogram)
+
+
+class DES:
+    # integer event codes, ordered like the tie-breaking between events that
+    # happen at the same time
+    __EVENT_ARRIVAL = 0
+    __EVENT_DEPARTURE = 1
+    __EVENT_OBSERVER = 2
+
+    # number of packets drawn at once by the Lindley engine
+    __LINDLEY_CHUNK_SIZE = 65536
+
+    # arrivals between two looks at the wall clock for checkpoints and
+    # progress reports
+    __CHECKPOINT_EVENTS = 65536
+
+    # steady-state mode simulates batches of about this many arrivals at
+    # first and, once the warm-up is cut, regroups them into a fixed number
+    # of batch means with their two-sided 95% Student t quantile; at most
+    # __BATCH_LIMIT batches are kept, neighbours merge when they fill up
+    __BATCH_ARRIVALS = 1000
+    __BATCH_COUNT = 20
+    __BATCH_LIMIT = 8 * __BATCH_COUNT
+    __BATCH_T_QUANTILE = 2.093
+    # probabilities near zero never meet a relative target, so they also
+    # count as converged within this absolute half-width
+    __BATCH_ABSOLUTE_HALF_WIDTH = 1e-3
+    __BATCH_PROBABILITIES = ("idle_time_proportion", "packet_loss_probability")
+
+    # warm-up of a parallel segment when none is given, as a fraction of
+    # the segment length
+    __SEGMENT_WARMUP_FRACTION = 0.1
+
+    ENGINE_EVENT = "event"
+    ENGINE_LINDLEY = "lindley"
+
+    # sample the queue with observer events, or integrate it over time
+    METRICS_OBSERVER = "observer"
+    METRICS_TIME_AVERAGE = "time_average"
+
+    def __init__(self, packet_length_avg, trans_rate, sim_time, buffer_size,
+                 rho, is_streaming=False, engine=ENGINE_EVENT,
+                 histogram_size=None,
+                 metrics_mode=METRICS_OBSERVER, seed=None,
+                 checkpoint_path=None, checkpoint_interval=None,
+                 progress_callback=None, progress_interval=None,
+                 steady_state_ci=None, warmup_time=0.0, segments=None,
+                 segment_warmup=None, processes=None,
+                 packet_length_distribution=None, arrival_process=None,
+                 trace_path=None):
+        if checkpoint_path is not None and engine != DES.ENGINE_EVENT:
+            raise ValueError("checkpointing needs the event engine")
+
+        if steady_state_ci is not None and engine != DES.ENGINE_EVENT:
+            raise ValueError("steady-state estimation needs the event engine")
+
+        if trace_path is not None and segments is not None:
+            raise ValueError("a trace is replayed in one piece")
+
+        # an unstable infinite queue never forgets its start, each segment
+        # would restart from the short queue of its warm-up
+        if segments is not None and buffer_size == math.inf and rho >= 1:
+            raise ValueError("segments need a finite buffer or rho below 1")
+
+        if (warmup_time or segments is not None) and (
+                engine != DES.ENGINE_EVENT or steady_state_ci is not None
+                or checkpoint_path is not None):
+            raise ValueError("warm-up and segments need the event engine "
+                             "without steady-state estimation or checkpoints")
+
+        self.__params = {
+            "packet_length_avg": packet_length_avg,
+            "trans_rate": trans_rate,
+            "buffer_size": buffer_size,
+            "rho": rho,
+            "histogram_size": histogram_size,
+            "metrics_mode": metrics_mode,
+            "steady_state_ci": steady_state_ci,
+            "packet_length_distribution": packet_length_distribution,
+            "arrival_process": arrival_process,
+            "trace_path": trace_path
+        }
         self.__packet_length_avg = packet_length_avg
         self.__trans_rate = trans_rate
         self.__sim_time = sim_time
         self.__rho = rho
         self.__buffer_size = buffer_size
-        self.__lambda = rho*trans_rate/packet_length_avg
-
-    def __generate_packet_length(self):
-        return generate_random(1.0/self.__packet_length_avg)
-
-    def __calculate_service_time(self, packet_length):
-        return packet_length/self.__trans_rate
+        # exponential packet lengths and Poisson arrivals unless given; rho
+        # is the offered load of the actual mean packet length
+        self.__packet_length_distribution = packet_length_distribution \
+            or ExponentialDistribution(packet_length_avg)
+        self.__arrival_process = arrival_process or PoissonArrivals()
+
+        # a replayed trace brings its arrivals and lengths, rho is then its
+        # offered load up to sim_time
+        if trace_path is not None:
+            summary = summarize_trace(trace_path, sim_time)
+
+            if summary["packets"] == 0:
+                raise ValueError("trace has no packets before sim_time")
+
+            self.__rho = summary["total_length"] / (trans_rate * sim_time)
+            self.__packet_length_distribution = TraceDistribution(
+                trace_path, summary["total_length"] / summary["packets"])
+            self.__arrival_process = TraceArrivals(trace_path)
+
+        self.__lambda = self.__rho*trans_rate / \
+            self.__packet_length_distribution.mean
+        # checkpointed runs need event sources that can be pickled, a trace
+        # is never read into memory at once and a steady-state run usually
+        # stops long before sim_time
+        self.__is_streaming = is_streaming or checkpoint_path is not None or \
+            trace_path is not None or steady_state_ci is not None
+        # the Lindley engine works on numpy arrays, without numpy the same
+        # run goes through the event engine
+        self.__engine = engine if numpy is not None else DES.ENGINE_EVENT
+        self.__histogram_size = histogram_size
+        self.__is_time_average = metrics_mode == DES.METRICS_TIME_AVERAGE
+        # target CI half-width relative to the estimates, sim_time is then
+        # only the longest a run may take
+        self.__steady_state_ci = steady_state_ci
+        # statistics cover (warmup_time, sim_time] only
+        self.__warmup_time = warmup_time
+        # split the run into this many segments simulated in parallel, each
+        # starting empty segment_warmup before its share of the horizon
+        self.__segments = segments
+        self.__segment_warmup = segment_warmup
+        self.__processes = processes
+        self.__seed = seed
+        # independent streams so that each source is reproducible on its own
+        random_stream = RandomStream(seed)
+        self.__arrival_random = random_stream.spawn()
+        self.__service_random = random_stream.spawn()
+        self.__observer_random = random_stream.spawn()
+        self.__checkpoint_path = checkpoint_path
+        # checkpoints, progress reports and phase times of the event loop
+        self.__run_control = RunControl(
+            sim_time, DES.__count_events,
+            None if checkpoint_path is None else self.__save_checkpoint,
+            checkpoint_interval, progress_callback, progress_interval)
+        # event loop state, restored by resume
+        self.__state = None
+
+    @staticmethod
+    def resume(checkpoint_path, sim_time=None, checkpoint_interval=None,
+               **options):
+        # continue an interrupted run, or extend a finished one to a longer
+        # sim_time without simulating its prefix again
+        checkpoint, sim_time = load_checkpoint(
+            checkpoint_path, ENGINE_VERSION, sim_time)
+        instance = DES(sim_time=sim_time, checkpoint_path=checkpoint_path,
+                       checkpoint_interval=checkpoint_interval,
+                       **checkpoint["params"], **options)
+        (instance.__arrival_random, instance.__service_random,
+         instance.__observer_random) = checkpoint["random_streams"]
+        instance.__packet_length_distribution = checkpoint[
+            "packet_length_distribution"]
+
+        state = checkpoint["state"]
+        state["departure_events"] = deque(state["departure_events"])
+        sources = [("arrival_events", "next_arrival_time")]
+
+        if not instance.__is_time_average:
+            sources.append(("observer_events", "next_observer_time"))
+
+        for events, next_time in sources:
+            state[events].extend_to(sim_time)
+
+            if state[next_time] == math.inf:
+                state[next_time] = next(state[events], math.inf)
+
+        instance.__state = state
+
+        return instance
+
+    def __save_checkpoint(self, state):
+        save_checkpoint(self.__checkpoint_path, {
+            "engine_version": ENGINE_VERSION,
+            "params": self.__params,
+            "sim_time": self.__sim_time,
+            "random_streams": (self.__arrival_random, self.__service_random,
+                               self.__observer_random),
+            # a trace distribution knows how far its lengths have been read
+            "packet_length_distribution": self.__packet_length_distribution,
+            # departure times are stored compactly, 8 bytes each
+            "state": dict(state, departure_events=array(
+                "d", state["departure_events"]))
+        })
+
+    @property
+    def profile(self):
+        return self.__run_control.profile
+
+    @staticmethod
+    def __count_events(state):
+        return state["counter_total_packets"] + state["counter_departure"] + \
+            state["counter_observer"]
 
     def __generate_observer_event_interval(self):
-        return generate_random(self.__lambda * 5.0)
+        return self.__observer_random.exponential(self.__lambda * 5.0)
 
-    def __generate_arrival_event_interval(self):
-        return generate_random(self.__lambda)
+    def __generate_arrival_intervals(self):
+        return self.__arrival_process.intervals(
+            self.__arrival_random, self.__lambda)
 
     def __generate_observer_events(self):
         if __debug__:
             print("Generating Observer Events...\n")
             counter = 0
 
-        observer_events = []
+        # typed array of event times, 8 bytes per event instead of a boxed
+        # float and a list slot
+        observer_events = array("d")
         current_time = 0.0
 
         while True:
@@ -71,7 +642,7 @@ class DES:
             current_time += observer_event_interval
 
             if current_time <= self.__sim_time:
-                observer_events.append((current_time, DES.__EVENT_OBSERVER))
+                observer_events.append(current_time)
 
                 if __debug__:
                     counter += 1
@@ -92,15 +663,16 @@ class DES:
             print("Generating Arrival Events...\n")
             counter = 0
 
-        arrival_events = []
+        arrival_events = array("d")
+        next_interval = self.__generate_arrival_intervals().next_interval
         current_time = 0.0
 
         while True:
-            arrival_event_interval = self.__generate_arrival_event_interval()
+            arrival_event_interval = next_interval()
             current_time += arrival_event_interval
 
             if current_time <= self.__sim_time:
-                arrival_events.append((current_time, DES.__EVENT_ARRIVAL))
+                arrival_events.append(current_time)
 
                 if __debug__:
                     counter += 1
@@ -116,107 +688,450 @@ class DES:
                 break
         return arrival_events
 
-    def __combine_generated_events(self, *events_list):
-        if __debug__:
-            print("Combining Generated Events...\n")
-
-        combined_events = []
+    # lazily pull event times one at a time instead of building the whole list
+    def __stream_observer_events(self):
+        return PoissonProcess(
+            self.__observer_random, self.__lambda * 5.0, self.__sim_time)
 
-        for events in events_list:
-            combined_events += events
-
-        if __debug__:
-            str = (
-                "Combined Events List Length: %d\n"
-            ) % (len(combined_events))
-            print(str)
-
-        return combined_events
+    def __stream_arrival_events(self):
+        return ArrivalProcess(
+            self.__generate_arrival_intervals(), self.__sim_time)
 
     def __calculate_metrics(self, data):
         if __debug__:
             print("Calculating Metrics...\n")
 
-        packets_in_queue_avg = statistics.mean(
-            data["counter_packets_in_queue_list"])
-        idle_time_proportion = data["counter_idle"] / \
-            data["counter_observer"]
+        packets_in_queue_statistics = data["packets_in_queue_statistics"]
+
+        if self.__is_time_average:
+            idle_time_proportion = data["idle_time"] / \
+                (self.__sim_time - self.__warmup_time)
+        else:
+            idle_time_proportion = data["counter_idle"] / \
+                data["counter_observer"]
+
         packet_loss_probability = data["counter_dropped_packets"] / \
             data["counter_total_packets"]
 
-        return {
+        metrics = {
             "buffer_size": self.__buffer_size,
             "rho": self.__rho,
-            "packets_in_queue_avg": packets_in_queue_avg,
+            "packets_in_queue_avg": packets_in_queue_statistics.mean,
+            "packets_in_queue_variance": packets_in_queue_statistics.variance,
             "idle_time_proportion": idle_time_proportion,
             "packet_loss_probability": packet_loss_probability
         }
 
-    def __process_events(self, events):
-        if __debug__:
-            print("Processing Events...\n")
+        if self.__histogram_size:
+            metrics["packets_in_queue_histogram"] = \
+                packets_in_queue_statistics.histogram
 
-        heapq.heapify(events)
+        # steady-state estimates leave the warm-up out and come with their
+        # batch means CI half-widths
+        if data.get("steady_state") is not None:
+            metrics.update(data["steady_state"])
 
-        if __debug__:
-            print("Heapified Events...\n")
+        return metrics
 
-        counter_arrvial = 0
-        counter_departure = 0
-        counter_observer = 0
-        counter_idle = 0
-        counter_dropped_packets = 0
-        counter_total_packets = 0
-        counter_packets_in_queue = 0
-        counter_packets_in_queue_list = []
-        latest_departure_time = 0.0
+    def __initial_state(self, observer_events, arrival_events):
+        observer_events = iter(observer_events)
+        arrival_events = iter(arrival_events)
+
+        return {
+            "observer_events": observer_events,
+            "arrival_events": arrival_events,
+            "next_observer_time": next(observer_events, math.inf),
+            "next_arrival_time": next(arrival_events, math.inf),
+            # departure times of the packets in the system
+            "departure_events": deque(),
+            "counter_arrvial": 0,
+            "counter_departure": 0,
+            "counter_observer": 0,
+            "counter_idle": 0,
+            "counter_dropped_packets": 0,
+            "counter_total_packets": 0,
+            "counter_packets_in_queue": 0,
+            "packets_in_queue_statistics": OnlineStatistics(
+                self.__histogram_size),
+            "latest_departure_time": 0.0,
+            "idle_time": 0.0,
+            "last_event_time": 0.0,
+            # time of the last processed event
+            "clock": 0.0
+        }
+
+    def __advance_events(self, state, deadline, end_time):
+        # observer and arrival times are each sorted and departures of a FIFO
+        # queue are monotone, so the next event is the minimum of three heads
+        event_arrival = DES.__EVENT_ARRIVAL
+        event_departure = DES.__EVENT_DEPARTURE
+
+        observer_events = state["observer_events"]
+        arrival_events = state["arrival_events"]
+        departure_events = state["departure_events"]
+        next_observer_time = state["next_observer_time"]
+        next_arrival_time = state["next_arrival_time"]
+
+        counter_arrvial = state["counter_arrvial"]
+        counter_departure = state["counter_departure"]
+        counter_observer = state["counter_observer"]
+        counter_idle = state["counter_idle"]
+        counter_dropped_packets = state["counter_dropped_packets"]
+        counter_total_packets = state["counter_total_packets"]
+        counter_packets_in_queue = state["counter_packets_in_queue"]
+        add_packets_in_queue = state["packets_in_queue_statistics"].add
+        latest_departure_time = state["latest_departure_time"]
+        # time-average mode weights the queue length by how long it lasted
+        is_time_average = self.__is_time_average
+        sample_packet_length = self.__packet_length_distribution.sample
+        service_random = self.__service_random
+        trans_rate = self.__trans_rate
+        sim_time = end_time
+        idle_time = state["idle_time"]
+        last_event_time = state["last_event_time"]
+        event_time = state["clock"]
+        is_finished = True
+        next_check_counter = counter_total_packets + DES.__CHECKPOINT_EVENTS
+
+        while True:
+            next_departure_time = departure_events[0] if departure_events \
+                else math.inf
+
+            # events past sim_time stay pending for a longer resumed run
+            if next_arrival_time <= next_departure_time \
+                    and next_arrival_time <= next_observer_time:
+                if next_arrival_time > sim_time:
+                    break
+
+                event_type = event_arrival
+                event_time = next_arrival_time
+                next_arrival_time = next(arrival_events, math.inf)
+            elif next_departure_time <= next_observer_time:
+                if next_departure_time > sim_time:
+                    break
+
+                event_type = event_departure
+                event_time = departure_events.popleft()
+            else:
+                if next_observer_time > sim_time:
+                    break
+
+                event_type = DES.__EVENT_OBSERVER
+                event_time = next_observer_time
+                next_observer_time = next(observer_events, math.inf)
+
+            if is_time_average:
+                duration = event_time - last_event_time
+
+                if duration > 0.0:
+                    add_packets_in_queue(counter_packets_in_queue, duration)
+
+                    if counter_packets_in_queue == 0:
+                        idle_time += duration
 
-        while events:
-            event = heapq.heappop(events)
+                    last_event_time = event_time
 
-            if event[1] == DES.__EVENT_DEPARTURE:
+            if event_type == event_departure:
                 counter_departure += 1
                 counter_packets_in_queue -= 1
 
                 if __debug__:
                     if counter_packets_in_queue < 0:
                         print("Error: Negative Packets Counter!")
-            elif event[1] == DES.__EVENT_ARRIVAL:
+            elif event_type == event_arrival:
                 counter_total_packets += 1
 
+                # a dropped packet still draws its length, so the k-th
+                # arrival gets the same service time whatever the buffer size
+                service_time = sample_packet_length(
+                    service_random) / trans_rate
+
                 if counter_packets_in_queue < self.__buffer_size:
                     counter_arrvial += 1
 
-                    packet_length = self.__generate_packet_length()
-                    service_time = self.__calculate_service_time(packet_length)
-
                     departure_time = 0.0
 
                     if counter_packets_in_queue == 0:
-                        departure_time = event[0] + service_time
+                        departure_time = event_time + service_time
                     else:
                         departure_time = max(
-                            latest_departure_time, event[0]) + service_time
+                            latest_departure_time, event_time) + service_time
 
                     if __debug__:
-                        if departure_time <= event[0] or departure_time <= latest_departure_time:
+                        if departure_time <= event_time \
+                                or departure_time <= latest_departure_time:
                             print("Error: Invalid Departure Time!")
 
                     latest_departure_time = departure_time
 
-                    heapq.heappush(
-                        events, (departure_time, DES.__EVENT_DEPARTURE))
+                    departure_events.append(departure_time)
 
                     counter_packets_in_queue += 1
                 else:
                     counter_dropped_packets += 1
+
+                if counter_total_packets >= next_check_counter:
+                    next_check_counter += DES.__CHECKPOINT_EVENTS
+
+                    if time.time() >= deadline:
+                        is_finished = False
+                        break
             else:
                 counter_observer += 1
 
                 if counter_packets_in_queue == 0:
                     counter_idle += 1
 
-                counter_packets_in_queue_list.append(counter_packets_in_queue)
+                add_packets_in_queue(counter_packets_in_queue)
+
+        state.update({
+            "next_observer_time": next_observer_time,
+            "next_arrival_time": next_arrival_time,
+            "counter_arrvial": counter_arrvial,
+            "counter_departure": counter_departure,
+            "counter_observer": counter_observer,
+            "counter_idle": counter_idle,
+            "counter_dropped_packets": counter_dropped_packets,
+            "counter_total_packets": counter_total_packets,
+            "counter_packets_in_queue": counter_packets_in_queue,
+            "latest_departure_time": latest_departure_time,
+            "idle_time": idle_time,
+            "last_event_time": last_event_time,
+            "clock": event_time
+        })
+
+        return is_finished
+
+    def __snapshot_batch(self, state):
+        # cumulative sums a batch is the difference of: queue length weight,
+        # sum and sum of squares, idle and its weight, dropped and all packets
+        packets_in_queue_statistics = state["packets_in_queue_statistics"]
+        weight = packets_in_queue_statistics.count
+        mean = packets_in_queue_statistics.mean
+        total = mean * weight
+        squares = (packets_in_queue_statistics.variance + mean * mean) * weight
+
+        if self.__is_time_average:
+            idle, idle_weight = state["idle_time"], weight
+        else:
+            idle, idle_weight = state["counter_idle"], state["counter_observer"]
+
+        return (weight, total, squares, idle, idle_weight,
+                state["counter_dropped_packets"],
+                state["counter_total_packets"])
+
+    @staticmethod
+    def __estimate_batch(batch):
+        weight, total, squares, idle, idle_weight, dropped, total_packets = \
+            batch
+        mean = total / weight if weight else 0.0
+
+        return {
+            "packets_in_queue_avg": mean,
+            "packets_in_queue_variance": squares / weight - mean * mean
+            if weight else 0.0,
+            "idle_time_proportion": idle / idle_weight if idle_weight else 0.0,
+            "packet_loss_probability": dropped / total_packets
+            if total_packets else 0.0
+        }
+
+    def __estimate_steady_state(self, batches, batch_length):
+        batch_count = DES.__BATCH_COUNT
+
+        if len(batches) < batch_count:
+            return None
+
+        # MSER warm-up detection: cut the first d batches where the squared
+        # standard error of the remaining batch means is smallest, looking
+        # at most at the first half of the run and keeping batch_count
+        means = [batch[1] / batch[0] if batch[0] else 0.0 for batch in batches]
+        suffix_sums = list(accumulate(reversed(means), initial=0.0))[::-1]
+        suffix_squares = list(accumulate(
+            (mean * mean for mean in reversed(means)), initial=0.0))[::-1]
+        warmup_batches = min(
+            range(min(len(batches) // 2, len(batches) - batch_count) + 1),
+            key=lambda d: (
+                suffix_squares[d] - suffix_sums[d] ** 2 / (len(batches) - d))
+            / (len(batches) - d) ** 2)
+
+        # equal groups of the kept batches, the oldest leftovers go too
+        group_size = (len(batches) - warmup_batches) // batch_count
+        kept_batches = batches[len(batches) - group_size * batch_count:]
+        groups = [[sum(column)
+                   for column in zip(*kept_batches[k:k + group_size])]
+                  for k in range(0, len(kept_batches), group_size)]
+
+        estimates = DES.__estimate_batch(
+            [sum(column) for column in zip(*kept_batches)])
+        group_estimates = [DES.__estimate_batch(group) for group in groups]
+        is_converged = True
+
+        for name in list(estimates):
+            half_width = DES.__BATCH_T_QUANTILE * statistics.stdev(
+                group_estimate[name] for group_estimate in group_estimates) \
+                / math.sqrt(batch_count)
+            estimates[name + "_half_width"] = half_width
+
+            if name == "packets_in_queue_variance":
+                continue
+
+            target = self.__steady_state_ci * abs(estimates[name])
+
+            if name in DES.__BATCH_PROBABILITIES:
+                target = max(target, DES.__BATCH_ABSOLUTE_HALF_WIDTH)
+
+            if half_width > target:
+                is_converged = False
+
+        estimates["warmup_time"] = (len(batches) -
+                                    len(kept_batches)) * batch_length
+        estimates["is_converged"] = is_converged
+
+        return estimates
+
+    def __run_steady_state(self, state):
+        # simulate batch after batch and check whether the batch means agree
+        # closely enough each time the simulated time grows by a quarter, so
+        # the checks cost a logarithmic number of passes over at most
+        # __BATCH_LIMIT batches; once that many are kept, neighbours merge
+        # so the batch length doubles and a checkpoint never holds more
+        state.setdefault("batches", [])
+        state.setdefault("batch_length",
+                         DES.__BATCH_ARRIVALS / self.__lambda)
+        state.setdefault("batch_end_time", 0.0)
+        state.setdefault("estimate_batches", 2 * DES.__BATCH_COUNT)
+
+        while True:
+            batches = state["batches"]
+            # the start of the batch survives a checkpoint taken inside it
+            snapshot = state.setdefault("batch_snapshot",
+                                        self.__snapshot_batch(state))
+            end_time = min(state["batch_end_time"] + state["batch_length"],
+                           self.__sim_time)
+
+            self.__run_control.run_segments(
+                self.__advance_events, state, end_time)
+            batches.append(
+                tuple(map(sub, self.__snapshot_batch(state), snapshot)))
+            state["batch_end_time"] = end_time
+            del state["batch_snapshot"]
+            is_finished = end_time >= self.__sim_time
+
+            if not is_finished and len(batches) < state["estimate_batches"]:
+                continue
+
+            estimates = self.__estimate_steady_state(
+                batches, state["batch_length"])
+
+            if len(batches) == DES.__BATCH_LIMIT:
+                batches = state["batches"] = [
+                    tuple(map(add, first, second))
+                    for first, second in zip(batches[::2], batches[1::2])]
+                state["batch_length"] *= 2
+
+            state["estimate_batches"] = min(
+                len(batches) + len(batches) // 4, DES.__BATCH_LIMIT)
+
+            if is_finished or estimates is not None \
+                    and estimates["is_converged"]:
+                if self.__checkpoint_path is not None:
+                    self.__save_checkpoint(state)
+
+                if estimates is not None:
+                    estimates["simulated_time"] = end_time
+
+                return estimates
+
+    def __discard_warmup(self, state):
+        # the queue carries on as it is, only what was measured is dropped
+        state.update({
+            "counter_arrvial": 0,
+            "counter_departure": 0,
+            "counter_observer": 0,
+            "counter_idle": 0,
+            "counter_dropped_packets": 0,
+            "counter_total_packets": 0,
+            "packets_in_queue_statistics": OnlineStatistics(
+                self.__histogram_size),
+            "idle_time": 0.0,
+            "last_event_time": self.__warmup_time
+        })
+
+    def __process_segments(self):
+        # segment i covers its share of the horizon after a warm-up window
+        # that overlaps the previous segment, so it starts close to the
+        # steady state; the first one starts empty at 0 like a serial run
+        segment_length = self.__sim_time / self.__segments
+        segment_warmup = DES.__SEGMENT_WARMUP_FRACTION * segment_length \
+            if self.__segment_warmup is None else self.__segment_warmup
+        options = []
+
+        for segment in range(self.__segments):
+            warmup_time = min(segment_warmup, segment * segment_length)
+            options.append({
+                "packet_length_avg": self.__packet_length_avg,
+                "trans_rate": self.__trans_rate,
+                "sim_time": warmup_time + segment_length,
+                "buffer_size": self.__buffer_size,
+                "rho": self.__rho,
+                "is_streaming": self.__is_streaming,
+                "histogram_size": self.__histogram_size,
+                "metrics_mode": DES.METRICS_TIME_AVERAGE
+                if self.__is_time_average else DES.METRICS_OBSERVER,
+                "seed": None if self.__seed is None
+                else "%s:segment:%d" % (self.__seed, segment),
+                "packet_length_distribution": self.__packet_length_distribution,
+                "arrival_process": self.__arrival_process,
+                "warmup_time": warmup_time
+            })
+
+        with Pool(self.__processes) as pool:
+            segments_data = pool.map(simulate_segment, options, chunksize=1)
+
+        # counters add up, the queue length statistics merge
+        packets_in_queue_statistics = OnlineStatistics(self.__histogram_size)
+        data = {"packets_in_queue_statistics": packets_in_queue_statistics,
+                "steady_state": None}
+
+        for segment_data in segments_data:
+            packets_in_queue_statistics.merge(
+                segment_data["packets_in_queue_statistics"])
+
+            for name in ["counter_idle", "counter_observer", "idle_time",
+                         "counter_dropped_packets", "counter_total_packets",
+                         "counter_events"]:
+                data[name] = data.get(name, 0) + segment_data[name]
+
+        return data
+
+    def __process_events(self, state):
+        if __debug__:
+            print("Processing Events...\n")
+
+        if self.__warmup_time:
+            self.__run_control.run_segments(
+                self.__advance_events, state, self.__warmup_time)
+            self.__discard_warmup(state)
+
+        if self.__steady_state_ci is None:
+            self.__run_control.run_segments(self.__advance_events, state)
+            steady_state = None
+        else:
+            steady_state = self.__run_steady_state(state)
+
+        packets_in_queue_statistics = state["packets_in_queue_statistics"]
+        idle_time = state["idle_time"]
+
+        if steady_state is None and self.__is_time_average \
+                and state["last_event_time"] < self.__sim_time:
+            # the queue holds its last length until sim_time; the checkpoint
+            # is already saved, so a longer run does not count this twice
+            duration = self.__sim_time - state["last_event_time"]
+            packets_in_queue_statistics.add(
+                state["counter_packets_in_queue"], duration)
+
+            if state["counter_packets_in_queue"] == 0:
+                idle_time += duration
 
         if __debug__:
             str = (
@@ -227,19 +1142,217 @@ class DES:
                 "Dropped Counter:          %d\n"
                 "Total Packets Counter:    %d\n"
                 "Packets in Queue Counter: %d\n"
-                "List Counter Length:      %d\n"
+                "Packets in Queue Avg:     %.10f\n"
                 "Latest Departure Time:    %.10f\n"
-            ) % (counter_arrvial, counter_departure, counter_observer, counter_idle, counter_dropped_packets, counter_total_packets, counter_packets_in_queue, len(counter_packets_in_queue_list), latest_departure_time)
+            ) % (state["counter_arrvial"], state["counter_departure"],
+                 state["counter_observer"], state["counter_idle"],
+                 state["counter_dropped_packets"],
+                 state["counter_total_packets"],
+                 state["counter_packets_in_queue"],
+                 packets_in_queue_statistics.mean,
+                 state["latest_departure_time"])
             print(str)
 
         return {
-            "counter_packets_in_queue_list": counter_packets_in_queue_list,
+            "packets_in_queue_statistics": packets_in_queue_statistics,
+            "counter_idle": state["counter_idle"],
+            "counter_observer": state["counter_observer"],
+            "idle_time": idle_time,
+            "counter_dropped_packets": state["counter_dropped_packets"],
+            "counter_total_packets": state["counter_total_packets"],
+            "counter_events": DES.__count_events(state),
+            "steady_state": steady_state
+        }
+
+    def __process_events_lindley(self):
+        # arrivals are drawn a chunk at a time and departure times follow
+        # the Lindley recursion d = max(d_prev, a) + s; the queue length is
+        # then a step function of the accepted arrivals and the departures,
+        # read at the observer times or integrated over time
+        if __debug__:
+            print("Processing Events with Lindley Recursion...\n")
+
+        buffer_size = self.__buffer_size
+        sim_time = self.__sim_time
+        arrival_intervals = self.__generate_arrival_intervals()
+
+        counter_observer = 0
+        counter_idle = 0
+        counter_dropped_packets = 0
+        counter_total_packets = 0
+        packets_in_queue_statistics = OnlineStatistics(self.__histogram_size)
+        latest_departure_time = 0.0
+        # departure times of the packets still in the system, in order
+        in_system = numpy.empty(0)
+        pending_observer_times = numpy.empty(0)
+        idle_time = 0.0
+        window_start_time = 0.0
+        arrival_time = 0.0
+        is_last_chunk = False
+
+        while not is_last_chunk:
+            arrival_times = arrival_time + numpy.cumsum(
+                arrival_intervals.next_intervals(DES.__LINDLEY_CHUNK_SIZE))
+            arrival_time = arrival_times[-1].item()
+
+            if arrival_time > sim_time:
+                is_last_chunk = True
+                arrival_times = arrival_times[:numpy.searchsorted(
+                    arrival_times, sim_time, "right")]
+                window_end_time = sim_time
+            else:
+                window_end_time = arrival_time
+
+            service_times = self.__packet_length_distribution.samples(
+                self.__service_random, len(arrival_times), self.__trans_rate)
+            counter_carried_packets = len(in_system)
+
+            if buffer_size == math.inf:
+                # without drops the recursion unrolls to
+                # d_n = S_n + max(d_0, max_k(a_k - S_(k-1))) with S the
+                # cumulative service time
+                accepted_arrival_times = arrival_times
+                cumulative_service_times = numpy.cumsum(service_times)
+                new_departure_times = cumulative_service_times + numpy.maximum(
+                    numpy.maximum.accumulate(arrival_times - (
+                        cumulative_service_times - service_times)),
+                    latest_departure_time)
+                departure_times = numpy.concatenate(
+                    (in_system, new_departure_times))
+
+                if len(new_departure_times):
+                    latest_departure_time = new_departure_times[-1].item()
+            else:
+                # whether a packet is dropped depends on every departure
+                # before it, so a finite buffer is walked packet by packet;
+                # departure_times[head:] are the packets in the system
+                accepted_arrival_times = []
+                departure_times = in_system.tolist()
+                head = 0
+                tail = len(departure_times)
+
+                for packet_arrival_time, service_time in zip(
+                        arrival_times.tolist(), service_times.tolist()):
+                    while head < tail and \
+                            departure_times[head] < packet_arrival_time:
+                        head += 1
+
+                    if tail - head < buffer_size:
+                        latest_departure_time = max(
+                            latest_departure_time, packet_arrival_time) + \
+                            service_time
+                        departure_times.append(latest_departure_time)
+                        accepted_arrival_times.append(packet_arrival_time)
+                        tail += 1
+                    else:
+                        counter_dropped_packets += 1
+
+                accepted_arrival_times = numpy.array(accepted_arrival_times)
+                departure_times = numpy.array(departure_times)
+
+            counter_total_packets += len(arrival_times)
+
+            departure_count = numpy.searchsorted(
+                departure_times, window_end_time, "right")
+            in_system = departure_times[departure_count:]
+
+            # the queue goes up at accepted arrivals and down at departures,
+            # arrivals first at equal times like in the event engine
+            step_times = numpy.concatenate(
+                (accepted_arrival_times, departure_times[:departure_count]))
+            order = numpy.argsort(step_times, kind="stable")
+            step_times = step_times[order]
+            # step_packets_in_queue[i] holds from the i-th step on
+            step_packets_in_queue = counter_carried_packets + numpy.cumsum(
+                numpy.repeat([0, 1, -1], [1, len(accepted_arrival_times),
+                                          departure_count])[
+                    numpy.concatenate(([0], order + 1))])
+
+            if self.__is_time_average:
+                # weight each step by how long it lasted within the window
+                weights = numpy.bincount(
+                    step_packets_in_queue, weights=numpy.diff(
+                        step_times, prepend=window_start_time,
+                        append=window_end_time))
+                idle_time += weights[0].item()
+            else:
+                # observers falling into this chunk's time window, each one
+                # sees the steps up to and including its time
+                while not len(pending_observer_times) \
+                        or pending_observer_times[-1] <= window_end_time:
+                    pending_observer_times = numpy.concatenate((
+                        pending_observer_times,
+                        (pending_observer_times[-1]
+                         if len(pending_observer_times) else 0.0)
+                        + numpy.cumsum(self.__observer_random.exponentials(
+                            self.__lambda * 5.0, DES.__LINDLEY_CHUNK_SIZE))))
+
+                observer_count = numpy.searchsorted(
+                    pending_observer_times, window_end_time, "right")
+                weights = numpy.bincount(step_packets_in_queue[
+                    numpy.searchsorted(step_times, pending_observer_times[
+                        :observer_count], "right")], minlength=1)
+                pending_observer_times = pending_observer_times[
+                    observer_count:]
+
+                counter_observer += observer_count.item()
+                counter_idle += weights[0].item()
+
+            for packets_in_queue in numpy.flatnonzero(weights).tolist():
+                packets_in_queue_statistics.add(
+                    packets_in_queue, weights[packets_in_queue].item())
+
+            window_start_time = window_end_time
+
+        if __debug__:
+            str = (
+                "Observer Counter:         %d\n"
+                "Idle Counter:             %d\n"
+                "Dropped Counter:          %d\n"
+                "Total Packets Counter:    %d\n"
+                "Packets in Queue Avg:     %.10f\n"
+                "Latest Departure Time:    %.10f\n"
+            ) % (counter_observer, counter_idle, counter_dropped_packets,
+                 counter_total_packets, packets_in_queue_statistics.mean,
+                 latest_departure_time)
+            print(str)
+
+        return {
+            "packets_in_queue_statistics": packets_in_queue_statistics,
             "counter_idle": counter_idle,
             "counter_observer": counter_observer,
+            "idle_time": idle_time,
             "counter_dropped_packets": counter_dropped_packets,
-            "counter_total_packets": counter_total_packets
+            "counter_total_packets": counter_total_packets,
+            # arrivals, departures before sim_time and observers
+            "counter_events": 2 * counter_total_packets -
+            counter_dropped_packets - len(in_system) + counter_observer,
+            "steady_state": None
         }
 
+    def __generate_state(self):
+        if self.__is_time_average:
+            # the queue is integrated over time, no observer is needed
+            observer_events = []
+        elif self.__is_streaming:
+            observer_events = self.__stream_observer_events()
+        else:
+            observer_events = self.__generate_observer_events()
+
+        if self.__is_streaming:
+            arrival_events = self.__stream_arrival_events()
+        else:
+            arrival_events = self.__generate_arrival_events()
+
+        self.__state = self.__initial_state(observer_events, arrival_events)
+
+    def sim_segment(self):
+        # raw counters of the run without metrics or report, for a parent
+        # that stitches segments together
+        self.__generate_state()
+
+        return self.__process_events(self.__state)
+
     def sim_MM1_queue(self):
         if self.__buffer_size == float("inf"):
             return self.sim_MM1K_queue()
@@ -255,18 +1368,49 @@ class DES:
             "Start Time: %s\n\n"
         ) % (self.__buffer_size, self.__rho, start_time)
 
-        observer_events = self.__generate_observer_events()
-        arrival_events = self.__generate_arrival_events()
-        combined_events = self.__combine_generated_events(
-            observer_events, arrival_events)
-        data = self.__process_events(combined_events)
+        phase_start_time = time.perf_counter()
+
+        if self.__engine == DES.ENGINE_LINDLEY:
+            # the Lindley engine draws its variates chunk by chunk while
+            # processing, there is no separate generation phase
+            data = self.__process_events_lindley()
+        elif self.__segments is not None:
+            data = self.__process_segments()
+        else:
+            # a resumed run already holds its event sources
+            if self.__state is None:
+                self.__generate_state()
+                phase_start_time = self.__run_control.record_phase(
+                    "generation", phase_start_time)
+
+            data = self.__process_events(self.__state)
+
+        phase_start_time = self.__run_control.record_phase(
+            "processing", phase_start_time)
         metrics = self.__calculate_metrics(data)
+        self.__run_control.record_phase("metrics", phase_start_time)
+        self.__run_control.counter_events = data["counter_events"]
 
         str += (
             "Packets in Queue Avg:    %.10f\n"
+            "Packets in Queue Var:    %.10f\n"
             "Idle Time Proportion:    %.10f\n"
             "Packet Loss Probability: %.10f\n\n"
-        ) % (metrics["packets_in_queue_avg"], metrics["idle_time_proportion"], metrics["packet_loss_probability"])
+        ) % (metrics["packets_in_queue_avg"],
+             metrics["packets_in_queue_variance"],
+             metrics["idle_time_proportion"],
+             metrics["packet_loss_probability"])
+
+        if self.__segments is not None:
+            str += "Segments:                %d\n\n" % (self.__segments)
+
+        if "warmup_time" in metrics:
+            str += (
+                "Warm-up Time:            %.10f\n"
+                "Simulated Time:          %.10f\n"
+                "Converged:               %s\n\n"
+            ) % (metrics["warmup_time"], metrics["simulated_time"],
+                 metrics["is_converged"])
 
         end_time = datetime.now().time()
         str += (
@@ -277,9 +1421,81 @@ class DES:
         return [metrics, str]
 
 
-def start_DES(lock, packet_length_avg, trans_rate, sim_time, buffer_size, rho):
-    DES_instance = DES(packet_length_avg, trans_rate,
-                       sim_time, buffer_size, rho)
+def simulate_segment(options):
+    return DES(**options).sim_segment()
+
+
+def parse_packet_lengths(spec, packet_length_avg):
+    # exponential, deterministic, bimodal:SMALL,LARGE,P_SMALL or
+    # empirical:FILE
+    name, _, args = spec.partition(":")
+
+    if name == "exponential":
+        return ExponentialDistribution(packet_length_avg)
+    elif name == "deterministic":
+        return DeterministicDistribution(packet_length_avg)
+    elif name == "bimodal":
+        small, large, p_small = map(float, args.split(","))
+
+        return EmpiricalDistribution([small, large], [p_small, 1.0 - p_small])
+    elif name == "empirical":
+        return EmpiricalDistribution.from_file(args)
+
+    raise ValueError("unknown packet length distribution %s" % spec)
+
+
+def parse_arrivals(spec):
+    # poisson, onoff:ON_TIME,OFF_TIME or mmpp:ON_TIME,OFF_TIME,OFF_RATE_RATIO
+    name, _, args = spec.partition(":")
+
+    if name == "poisson":
+        return PoissonArrivals()
+    elif name == "onoff":
+        on_time, off_time = map(float, args.split(","))
+
+        return MMPPArrivals(on_time, off_time)
+    elif name == "mmpp":
+        on_time, off_time, off_rate_ratio = map(float, args.split(","))
+
+        return MMPPArrivals(on_time, off_time, off_rate_ratio)
+
+    raise ValueError("unknown arrival process %s" % spec)
+
+
+def start_DES(packet_length_avg, trans_rate, sim_time, buffer_size, rho,
+              checkpoint_dir=None, checkpoint_interval=None,
+              progress_interval=None, packet_lengths="exponential",
+              arrivals="poisson", **options):
+    job = {"buffer_size": buffer_size, "rho": rho, "seed": options.get("seed")}
+    progress_options = {"progress_callback": partial(emit, "progress", job),
+                        "progress_interval": progress_interval}
+    # the specs, not the objects, identify a run in the checkpoint key
+    model_options = {
+        "packet_length_distribution": parse_packet_lengths(
+            packet_lengths, packet_length_avg),
+        "arrival_process": parse_arrivals(arrivals)
+    }
+    emit("start", job, sim_time=sim_time)
+
+    if checkpoint_dir is None:
+        DES_instance = DES(packet_length_avg, trans_rate, sim_time,
+                           buffer_size, rho, **options, **model_options,
+                           **progress_options)
+    else:
+        # checkpointed runs always stream on the event engine
+        options.pop("is_streaming", None)
+
+        if options.pop("engine", DES.ENGINE_EVENT) != DES.ENGINE_EVENT:
+            raise ValueError("checkpointing needs the event engine")
+
+        DES_instance = resume_run(
+            DES.resume,
+            partial(DES, packet_length_avg, trans_rate, sim_time, buffer_size,
+                    rho, **options, **model_options),
+            checkpoint_dir,
+            [ENGINE_VERSION, packet_length_avg, trans_rate, buffer_size, rho,
+             packet_lengths, arrivals, options],
+            sim_time, checkpoint_interval, **progress_options)
     res = []
 
     if buffer_size == float("inf"):
@@ -287,12 +1503,7 @@ def start_DES(lock, packet_length_avg, trans_rate, sim_time, buffer_size, rho):
     else:
         res = DES_instance.sim_MM1K_queue()
 
-    lock.acquire()
-
-    try:
-        print(res[1])
-    finally:
-        lock.release()
+    emit("result", job, metrics=res[0], report=res[1])
 
     return res[0]
 
@@ -302,7 +1513,7 @@ def write_to_csv(fields, headers, rows):
     filename = ("lab1_output_%s.csv") % (round(timestamp))
 
     with open(filename, "w") as csvfile:
-        csvwriter = csv.DictWriter(csvfile, fields)
+        csvwriter = csv.DictWriter(csvfile, fields, extrasaction="ignore")
         csvwriter.writerow(headers)
         csvwriter.writerows(rows)
 
@@ -313,54 +1524,374 @@ def write_to_csv(fields, headers, rows):
     print(str)
 
 
+def estimate_cost(point):
+    # events grow with the arrival rate, the queue itself is cheap
+    return point["rho"]
+
+
+# analytical
+# closed forms of the stable M/M/1 and of every M/M/1/K, where the number in
+# system has a known stationary distribution; points with one need no
+# simulation, and simulated points can be checked against it
+VALIDATION_METRICS = ["packets_in_queue_avg",
+                      "idle_time_proportion", "packet_loss_probability"]
+# smallest deviation reported as a failure, so that probabilities close to
+# zero are not judged on their relative error
+VALIDATION_ABSOLUTE_TOLERANCE = 1e-3
+
+
+def analytical_metrics(buffer_size, rho):
+    if buffer_size == float("inf"):
+        # the queue grows without bound, there is no steady state
+        if rho >= 1.0:
+            return None
+
+        return {
+            "buffer_size": buffer_size,
+            "rho": rho,
+            "packets_in_queue_avg": rho / (1.0 - rho),
+            "packets_in_queue_variance": rho / (1.0 - rho)**2,
+            "idle_time_proportion": 1.0 - rho,
+            "packet_loss_probability": 0.0
+        }
+
+    # p_n is proportional to rho^n for n = 0..K; the weights are scaled by
+    # the largest one so that rho > 1 does not overflow
+    if rho <= 1.0:
+        weights = [rho**n for n in range(buffer_size + 1)]
+    else:
+        weights = [rho**(n - buffer_size) for n in range(buffer_size + 1)]
+
+    total = math.fsum(weights)
+    probabilities = [weight / total for weight in weights]
+    packets_in_queue_avg = math.fsum(
+        n * probability for n, probability in enumerate(probabilities))
+
+    return {
+        "buffer_size": buffer_size,
+        "rho": rho,
+        "packets_in_queue_avg": packets_in_queue_avg,
+        "packets_in_queue_variance": math.fsum(
+            (n - packets_in_queue_avg)**2 * probability
+            for n, probability in enumerate(probabilities)),
+        "idle_time_proportion": probabilities[0],
+        # arrivals see the time averages (PASTA), so they are dropped with
+        # the probability of a full system
+        "packet_loss_probability": probabilities[-1]
+    }
+
+
+def validate_rows(rows, tolerance=0.1):
+    # a simulated metric fails when it is further from its closed form than
+    # both its 95% CI half-width and the tolerance relative to the closed form
+    str = "%-12s %6s %-24s %14s %14s %12s %s\n" % (
+        "Buffer Size", "Rho", "Metric", "Simulated", "Analytical",
+        "Deviation", "Status")
+    failures = 0
+
+    for row in rows:
+        expected = analytical_metrics(row["buffer_size"], row["rho"])
+
+        if expected is None:
+            continue
+
+        for metric in VALIDATION_METRICS:
+            deviation = abs(row[metric] - expected[metric])
+            ci = row.get(metric + "_ci", math.inf)
+            allowed = max(0.0 if math.isinf(ci) else ci,
+                          tolerance * abs(expected[metric]),
+                          VALIDATION_ABSOLUTE_TOLERANCE)
+
+            if deviation > allowed:
+                status = "FAILED"
+                failures += 1
+            else:
+                status = "ok"
+
+            str += "%-12s %6.2f %-24s %14.10f %14.10f %12.10f %s\n" % (
+                row["buffer_size"], row["rho"], metric, row[metric],
+                expected[metric], deviation, status)
+
+    str += (
+        "\nValidation Failures: %d\n\n"
+        "------------------------------------------------------\n"
+    ) % (failures)
+    print(str)
+
+    return failures
+
+
+# benchmark
+# canonical workloads with fixed seeds for run_benchmark, and the phases of
+# their profile it reports
+BENCHMARK_SEED = "benchmark"
+BENCHMARK_SIM_TIME = 500
+BENCHMARK_WORKLOADS = [
+    {"name": "mm1 rho=0.5", "buffer_size": float("inf"), "rho": 0.5,
+     "options": {}},
+    {"name": "mm1 rho=0.9", "buffer_size": float("inf"), "rho": 0.9,
+     "options": {}},
+    {"name": "mm1 rho=0.9 time_average", "buffer_size": float("inf"),
+     "rho": 0.9, "options": {"metrics_mode": DES.METRICS_TIME_AVERAGE}},
+    {"name": "mm1 rho=0.9 streaming", "buffer_size": float("inf"), "rho": 0.9,
+     "options": {"is_streaming": True}},
+    {"name": "mm1k K=10 rho=0.9", "buffer_size": 10, "rho": 0.9,
+     "options": {}},
+    {"name": "mm1k K=10 rho=1.5", "buffer_size": 10, "rho": 1.5,
+     "options": {}}
+]
+
+# the Lindley engine would only measure the event engine again without numpy
+if numpy is not None:
+    BENCHMARK_WORKLOADS += [
+        {"name": "mm1 rho=0.9 lindley", "buffer_size": float("inf"),
+         "rho": 0.9, "options": {"engine": DES.ENGINE_LINDLEY}},
+        {"name": "mm1 rho=0.9 time_average lindley",
+         "buffer_size": float("inf"), "rho": 0.9,
+         "options": {"engine": DES.ENGINE_LINDLEY,
+                     "metrics_mode": DES.METRICS_TIME_AVERAGE}},
+        {"name": "mm1k K=10 rho=1.5 lindley", "buffer_size": 10, "rho": 1.5,
+         "options": {"engine": DES.ENGINE_LINDLEY}}
+    ]
+BENCHMARK_PHASES = ["generation", "processing", "metrics"]
+
+
+def benchmark_workload(workload):
+    DES_instance = DES(2000.0, 1000000.0, BENCHMARK_SIM_TIME,
+                       workload["buffer_size"], workload["rho"],
+                       seed=BENCHMARK_SEED, **workload["options"])
+
+    return measure_benchmark(workload["name"], DES_instance,
+                             DES_instance.sim_MM1K_queue)
+
+
 def main():
     start_time = time.time()
 
+    parser = argparse.ArgumentParser(description="M/M/1 and M/M/1/K sweep")
+    add_sweep_arguments(parser)
+    parser.add_argument("--packet-lengths", default="exponential",
+                        help="exponential, deterministic, "
+                        "bimodal:SMALL,LARGE,P_SMALL or empirical:FILE of "
+                        "lengths and optional weights")
+    parser.add_argument("--arrivals", default="poisson",
+                        help="poisson, onoff:ON_TIME,OFF_TIME or "
+                        "mmpp:ON_TIME,OFF_TIME,OFF_RATE_RATIO")
+    parser.add_argument("--trace", default=None,
+                        help="replay this binary trace of little-endian "
+                        "float64 (arrival time, packet length) records")
+    parser.add_argument("--sim-time", type=float, default=1000.0,
+                        help="simulated seconds of every run")
+    parser.add_argument("--point", type=float, nargs=2, default=None,
+                        metavar=("BUFFER_SIZE", "RHO"),
+                        help="run only this point of the grid, inf for an "
+                        "infinite buffer")
+    parser.add_argument("--segments", type=int, default=None,
+                        help="split the run of --point into this many "
+                        "segments simulated in parallel")
+    parser.add_argument("--segment-warmup", type=float, default=None,
+                        help="simulated seconds each segment runs before it "
+                        "is measured, a tenth of a segment by default")
+    parser.add_argument("--steady-state-ci", type=float, default=None,
+                        help="cut the warm-up and stop each run once its "
+                        "batch means CI half-width is this fraction of the "
+                        "estimates, or 0.001 for probabilities")
+    parser.add_argument("--analytical", action="store_true",
+                        help="use the closed forms where they are exact and "
+                        "simulate only the other points")
+    parser.add_argument("--validate", action="store_true",
+                        help="compare every simulated point that has a "
+                        "closed form with it")
+    parser.add_argument("--validation-tolerance", type=float, default=0.1,
+                        help="deviation relative to the closed form accepted "
+                        "beyond the CI")
+    parser.add_argument("--engine", default=DES.ENGINE_EVENT,
+                        choices=[DES.ENGINE_EVENT, DES.ENGINE_LINDLEY],
+                        help="simulate event by event, or draw packets in "
+                        "chunks and vectorize the Lindley recursion with "
+                        "numpy")
+    parser.add_argument("--metrics-mode", default=DES.METRICS_OBSERVER,
+                        choices=[DES.METRICS_OBSERVER,
+                                 DES.METRICS_TIME_AVERAGE])
+    parser.add_argument("--streaming", action="store_true",
+                        help="draw events as each run goes instead of all up "
+                        "front, so memory stays flat however long sim_time "
+                        "is")
+    args = parser.parse_args()
+
+    if start_service(parser, args, benchmark_workload, BENCHMARK_WORKLOADS,
+                     BENCHMARK_PHASES, ENGINE_VERSION):
+        return
+
+    if args.engine == DES.ENGINE_LINDLEY and numpy is None:
+        print("numpy is not installed, using the event engine\n")
+        args.engine = DES.ENGINE_EVENT
+
+    if args.checkpoint_dir is not None and args.engine != DES.ENGINE_EVENT:
+        parser.error("--checkpoint-dir needs the event engine")
+
+    if args.steady_state_ci is not None and args.engine != DES.ENGINE_EVENT:
+        parser.error("--steady-state-ci needs the event engine")
+
+    if args.segments is not None and (
+            args.point is None or args.engine != DES.ENGINE_EVENT
+            or args.steady_state_ci is not None
+            or args.checkpoint_dir is not None
+            or args.coordinator is not None):
+        parser.error("--segments needs --point and the event engine, "
+                     "without --steady-state-ci, --checkpoint-dir or "
+                     "--coordinator")
+
+    if args.segments is not None and args.point[0] == math.inf and \
+            args.point[1] >= 1:
+        parser.error("--segments needs a finite buffer or rho below 1")
+
+    if args.trace is not None and (
+            args.segments is not None
+            or args.packet_lengths != "exponential"
+            or args.arrivals != "poisson"):
+        parser.error("--trace brings its own arrivals and packet lengths and "
+                     "runs in one piece")
+
+    if (args.analytical or args.validate) and (
+            args.packet_lengths != "exponential"
+            or args.arrivals != "poisson" or args.trace is not None):
+        parser.error("--analytical and --validate need exponential packet "
+                     "lengths and poisson arrivals")
+
+    if args.analytical and args.validate:
+        parser.error("--validate needs every point simulated, not --analytical")
+
     verify_generated_random(75.0)
 
     packet_length_avg = 2000.0
-    trans_rate = 1000000.0
-    sim_time = 1000
 
-    manager = Manager()
-    lock = manager.Lock()
-    pool = Pool(5)
+    try:
+        packet_length_distribution = parse_packet_lengths(
+            args.packet_lengths, packet_length_avg)
+        arrival_process = parse_arrivals(args.arrivals)
+    except (ValueError, OSError) as error:
+        parser.error(error)
+    trans_rate = 1000000.0
+    sim_time = args.sim_time
 
     fields = [
         "buffer_size",
         "rho",
+        "replications",
         "packets_in_queue_avg",
+        "packets_in_queue_variance",
         "idle_time_proportion",
         "packet_loss_probability"
     ]
     headers = {
         "buffer_size": "Buffer Size",
         "rho": "Queue Utilization (rho)",
+        "replications": "Replications",
         "packets_in_queue_avg": "Average Packets in Queue",
+        "packets_in_queue_variance": "Variance of Packets in Queue",
         "idle_time_proportion": "Idle Time Proportion",
         "packet_loss_probability": "Packet Loss Probability"
     }
-    rows = []
 
     # infinite buffer size
     rho_list_inf = [round(0.25 + 0.1*i, 2) for i in range(8)] + [1.2]
-    start_inf_DES = partial(start_DES, lock, packet_length_avg,
-                            trans_rate, sim_time, float("inf"))
-
-    rows += pool.map(start_inf_DES, rho_list_inf)
+    points = [{"buffer_size": float("inf"), "rho": rho}
+              for rho in rho_list_inf]
 
     # finite buffer size
     buffer_size_list = [10, 25, 50]
     rho_list_finite = [round(0.5 + 0.1*i, 1) for i in range(11)]
+    points += [{"buffer_size": buffer_size, "rho": rho}
+               for buffer_size in buffer_size_list for rho in rho_list_finite]
+
+    # the trace fixes rho, only the buffer sizes are swept
+    if args.trace is not None:
+        summary = summarize_trace(args.trace, sim_time)
+
+        if summary["packets"] == 0:
+            parser.error("the trace has no packets before --sim-time")
+
+        trace_rho = summary["total_length"] / (trans_rate * sim_time)
+        points = [{"buffer_size": buffer_size, "rho": trace_rho}
+                  for buffer_size in [float("inf")] + buffer_size_list]
+
+    if args.point is not None:
+        buffer_size, rho = args.point
+        points = [{"buffer_size": buffer_size if math.isinf(
+            buffer_size) else int(buffer_size), "rho": rho}]
+
+    # one long run on every core, no sweep around it
+    if args.segments is not None:
+        DES_instance = DES(
+            packet_length_avg, trans_rate, sim_time, points[0]["buffer_size"],
+            points[0]["rho"], metrics_mode=args.metrics_mode,
+            is_streaming=args.streaming, seed=args.seed,
+            segments=args.segments, segment_warmup=args.segment_warmup,
+            processes=args.processes,
+            packet_length_distribution=packet_length_distribution,
+            arrival_process=arrival_process)
+
+        metrics, str = DES_instance.sim_MM1K_queue()
+        print(str)
+        write_to_csv(fields, headers, [dict(metrics, replications=1)])
 
-    for buffer_size in buffer_size_list:
-        start_finite_DES = partial(start_DES, lock, packet_length_avg,
-                                   trans_rate, sim_time, buffer_size)
-
-        rows += pool.map(start_finite_DES, rho_list_finite)
+        str = (
+            "Execution Time: %s seconds\n\n"
+            "------------------------------------------------------\n"
+        ) % (time.time() - start_time)
+        print(str)
+
+        return
+
+    # exact points are answered at once, replications 0 marks them in the CSV
+    analytical_rows = {}
+    if args.analytical:
+        for index, point in enumerate(points):
+            metrics = analytical_metrics(point["buffer_size"], point["rho"])
+
+            if metrics is not None:
+                analytical_rows[index] = dict(metrics, replications=0)
+
+    simulated_points = [point for index, point in enumerate(
+        points) if index not in analytical_rows]
+
+    run_point = partial(start_DES, packet_length_avg, trans_rate, sim_time,
+                        engine=args.engine, metrics_mode=args.metrics_mode,
+                        is_streaming=args.streaming,
+                        steady_state_ci=args.steady_state_ci,
+                        packet_lengths=args.packet_lengths,
+                        arrivals=args.arrivals, trace_path=args.trace)
+    context = {"packet_length_avg": packet_length_avg,
+               "trans_rate": trans_rate, "sim_time": sim_time,
+               "engine": args.engine, "metrics_mode": args.metrics_mode,
+               "steady_state_ci": args.steady_state_ci,
+               "packet_lengths": args.packet_lengths,
+               "arrivals": args.arrivals, "trace": args.trace}
+
+    # the contents of the input files, not just their paths
+    if args.trace is not None:
+        context["trace_digest"] = file_digest(args.trace)
+
+    if args.packet_lengths.startswith("empirical:"):
+        context["packet_lengths_digest"] = file_digest(
+            args.packet_lengths.partition(":")[2])
+
+    simulated_rows = iter(run_sweep(
+        args, run_point, simulated_points, estimate_cost,
+        ["packets_in_queue_avg", "idle_time_proportion",
+         "packet_loss_probability"], ENGINE_VERSION, context))
+    rows = [analytical_rows[index] if index in analytical_rows
+            else next(simulated_rows)
+
+            for index in range(len(points))]
 
     write_to_csv(fields, headers, rows)
 
+    failures = 0
+    if args.validate:
+        failures = validate_rows(rows, args.validation_tolerance)
+
     end_time = time.time()
 
     str = (
@@ -369,6 +1900,9 @@ def main():
     ) % (end_time - start_time)
     print(str)
 
+    if failures:
+        raise SystemExit(1)
+
     return
 
 
@@ -1,10 +1,230 @@
+import argparse
 import csv
 import math
-import random
+import os
+import sys
 import time
+from bisect import bisect_right, insort
 from collections import deque
 from datetime import datetime
-from multiprocessing import Manager, Pool
+from functools import partial
+from itertools import accumulate
+
+# infrastructure shared by both labs: random streams, trace columns,
+# checkpointed runs, the sweep with its pool or coordinator, the result
+# cache, the columnar writer, the benchmark harness and the command line
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), os.pardir, "common"))
+from simulation import (CheckpointRangeError, RandomStream,  # noqa: E402
+                        RunControl, TraceColumn, add_sweep_arguments, emit,
+                        file_digest, load_checkpoint, measure_benchmark,
+                        resume_run, run_sweep, save_checkpoint,
+                        start_service)
+
+
+# bump whenever a change alters the numbers a seeded run produces, so that
+# cached results of the previous engines are never reused
+ENGINE_VERSION = 3
+
+
+# indexed min heap
+# min heap over the keys 0..n-1 that tracks where every key sits, so the
+# priority of any key can be changed in O(log n); ties go to the smaller key
+class IndexedMinHeap:
+    def __init__(self, priorities):
+        self.__priorities = list(priorities)
+        self.__heap = sorted(range(len(self.__priorities)),
+                             key=lambda k: (self.__priorities[k], k))
+        self.__positions = [0] * len(self.__heap)
+
+        for position, key in enumerate(self.__heap):
+            self.__positions[key] = position
+
+    def __less(self, key_a, key_b):
+        priority_a = self.__priorities[key_a]
+        priority_b = self.__priorities[key_b]
+
+        return priority_a < priority_b or (
+            priority_a == priority_b and key_a < key_b)
+
+    def __swap(self, position_a, position_b):
+        heap = self.__heap
+        heap[position_a], heap[position_b] = heap[position_b], heap[position_a]
+        self.__positions[heap[position_a]] = position_a
+        self.__positions[heap[position_b]] = position_b
+
+    def __sift_up(self, position):
+        heap = self.__heap
+
+        while position > 0:
+            parent = (position - 1) >> 1
+
+            if not self.__less(heap[position], heap[parent]):
+                break
+
+            self.__swap(position, parent)
+            position = parent
+
+    def __sift_down(self, position):
+        heap = self.__heap
+        size = len(heap)
+
+        while True:
+            smallest = position
+            left = 2 * position + 1
+            right = left + 1
+
+            if left < size and self.__less(heap[left], heap[smallest]):
+                smallest = left
+
+            if right < size and self.__less(heap[right], heap[smallest]):
+                smallest = right
+
+            if smallest == position:
+                break
+
+            self.__swap(position, smallest)
+            position = smallest
+
+    def update(self, key, priority):
+        old_priority = self.__priorities[key]
+        self.__priorities[key] = priority
+
+        if priority < old_priority:
+            self.__sift_up(self.__positions[key])
+        elif priority > old_priority:
+            self.__sift_down(self.__positions[key])
+
+    def peek(self):
+        key = self.__heap[0]
+
+        return key, self.__priorities[key]
+
+    def keys_at_most(self, bound):
+        # every subtree below a priority > bound can be skipped
+        heap = self.__heap
+        priorities = self.__priorities
+        size = len(heap)
+        keys = []
+        stack = [0] if size > 0 else []
+
+        while stack:
+            position = stack.pop()
+            key = heap[position]
+
+            if priorities[key] <= bound:
+                keys.append(key)
+                left = 2 * position + 1
+
+                if left < size:
+                    stack.append(left)
+
+                    if left + 1 < size:
+                        stack.append(left + 1)
+
+        return keys
+
+
+# sensing backoff
+# a non-persistent node that senses a busy bus draws r in [0, 2^w) slots at
+# retry w (w capped at the backoff max) until its total backoff reaches the
+# gap to the end of the busy period; for a gap of g slots the joint
+# distribution of the total and the number of retries is tabulated once, so
+# the whole sensing loop takes a single draw
+class SensingBackoff:
+    # larger gaps are rare and keep the retry loop
+    __MAX_GAP_SLOTS = 64
+    __MAX_TABLE_RETRIES = 32
+    # mass left sensing below which the table stops growing
+    __TAIL_PROBABILITY = 1e-12
+    __tables = {}
+
+    @staticmethod
+    def __build_table(gap_slots, backoff_max):
+        # probability of every total below the gap that is still sensing
+        sensing = [1.0] + [0.0] * (gap_slots - 1)
+        outcomes = []
+        probabilities = []
+
+        for retries in range(1, SensingBackoff.__MAX_TABLE_RETRIES + 1):
+            slot_num = 2**min(retries, backoff_max)
+            done_diff = [0.0] * (gap_slots + slot_num + 1)
+            sensing_diff = [0.0] * (gap_slots + 1)
+
+            for slots, probability in enumerate(sensing):
+                if probability == 0.0:
+                    continue
+
+                # totals slots..slots + slot_num - 1 are equally likely
+                probability /= slot_num
+
+                if slots + slot_num > gap_slots:
+                    done_diff[gap_slots] += probability
+                    done_diff[slots + slot_num] -= probability
+
+                sensing_diff[slots] += probability
+                sensing_diff[min(slots + slot_num, gap_slots)] -= probability
+
+            done = list(accumulate(done_diff))[gap_slots:-1]
+            outcomes += [(gap_slots + k, retries) for k in range(len(done))]
+            probabilities += done
+            sensing = list(accumulate(sensing_diff))[:-1]
+
+            if sum(sensing) < SensingBackoff.__TAIL_PROBABILITY:
+                break
+
+        # the rare totals still below the gap carry on with the retry loop
+        outcomes += [(slots, retries) for slots in range(gap_slots)]
+        probabilities += sensing
+
+        return outcomes, list(accumulate(probabilities))
+
+    @staticmethod
+    def sample(random_stream, gap_slots, backoff_max):
+        # returns the total backoff slots and the number of sensing retries
+        slots = 0
+        retries = 0
+
+        if gap_slots <= SensingBackoff.__MAX_GAP_SLOTS:
+            key = (gap_slots, backoff_max)
+
+            if key not in SensingBackoff.__tables:
+                SensingBackoff.__tables[key] = SensingBackoff.__build_table(
+                    gap_slots, backoff_max)
+
+            outcomes, cumulative = SensingBackoff.__tables[key]
+            index = bisect_right(
+                cumulative, random_stream.random() * cumulative[-1])
+            slots, retries = outcomes[min(index, len(outcomes) - 1)]
+
+        while slots < gap_slots:
+            retries += 1
+            slots += random_stream.randbelow(2**min(retries, backoff_max))
+
+        return slots, retries
+
+
+# poisson process
+# event times before end_time pulled one at a time; unlike a generator it can
+# be pickled along with a checkpoint
+class PoissonProcess:
+    def __init__(self, random_stream, lambda_, end_time):
+        self.__random_stream = random_stream
+        self.__lambda = lambda_
+        self.__end_time = end_time
+        self.__next_time = random_stream.exponential(lambda_)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__next_time >= self.__end_time:
+            raise StopIteration
+
+        event_time = self.__next_time
+        self.__next_time += self.__random_stream.exponential(self.__lambda)
+
+        return event_time
 
 
 # packets generator
@@ -13,64 +233,276 @@ class PacketsGenerator:
         self.__arrival_rate_avg = arrival_rate_avg
         self.__sim_time = sim_time
 
-    @staticmethod
-    def __generate_poisson_random(lambda_):
-        return -math.log(1.0 - random.random())/lambda_
+    def stream_packets(self, random_stream):
+        # arrival times are drawn only when a node needs its next packet
+        return PoissonProcess(
+            random_stream, self.__arrival_rate_avg, self.__sim_time)
+
+
+# trace
+# binary traces hold (arrival time, node) records sorted by time, read one
+# TraceColumn per field
+def summarize_trace(path, sim_time):
+    # packets up to sim_time and the nodes they come from, in one streaming
+    # pass
+    packets = 0
+    node_num = 0
+
+    for arrival_time, node in zip(TraceColumn(path, 0, 2),
+                                  TraceColumn(path, 1, 2)):
+        if arrival_time >= sim_time:
+            break
+
+        packets += 1
+        node_num = max(node_num, int(node) + 1)
+
+    return {"packets": packets, "node_num": node_num}
+
+
+# splits the single time-sorted trace into one packet stream per node; a
+# node asking for its next packet reads ahead until one turns up, and what
+# other nodes get meanwhile waits in their queues. A first pass counts each
+# node's packets before the horizon, so a node with none left ends at once
+# instead of reading the rest of the trace into the queues of the others,
+# and nothing past the horizon is ever read
+class TraceDemultiplexer:
+    def __init__(self, path, node_num, horizon):
+        self.__arrival_times = TraceColumn(path, 0, 2)
+        self.__nodes = TraceColumn(path, 1, 2)
+        self.__pending = [deque() for _ in range(node_num)]
+        # packets of each node before the horizon not read yet
+        self.__remaining = [0] * node_num
+
+        for arrival_time, node in zip(TraceColumn(path, 0, 2),
+                                      TraceColumn(path, 1, 2)):
+            if arrival_time >= horizon:
+                break
 
-    def generate_packets(self):
-        packets = deque()
-        current_time = 0.0
+            # packets of nodes the run does not have are left out
+            if node < node_num:
+                self.__remaining[int(node)] += 1
 
-        while True:
-            arrival_interval = self.__generate_poisson_random(
-                self.__arrival_rate_avg)
-            current_time += arrival_interval
+    def next_arrival_time(self, k):
+        pending = self.__pending[k]
 
-            if current_time < self.__sim_time:
-                packets.append(current_time)
-            else:
-                break
+        while not pending:
+            if not self.__remaining[k]:
+                return float("inf")
+
+            arrival_time = next(self.__arrival_times)
+            node = int(next(self.__nodes))
+
+            if node < len(self.__pending):
+                self.__pending[node].append(arrival_time)
+                self.__remaining[node] -= 1
+
+        return pending.popleft()
+
+
+class TracePackets:
+    def __init__(self, demultiplexer, k):
+        self.__demultiplexer = demultiplexer
+        self.__k = k
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        arrival_time = self.__demultiplexer.next_arrival_time(self.__k)
+
+        if arrival_time == float("inf"):
+            raise StopIteration
+
+        return arrival_time
+
+
+# quantile sketch
+# P-square estimate of one quantile of a stream (Jain and Chlamtac): five
+# markers track the minimum, the maximum, the quantile and two points halfway
+# to it, and their heights follow piecewise-parabolic interpolation, so the
+# stream is never stored
+class P2Quantile:
+    def __init__(self, p):
+        self.__p = p
+        # the first five samples sorted, then the marker heights
+        self.__heights = []
+        self.__positions = [1, 2, 3, 4, 5]
+        self.__desired_positions = [1.0, 1.0 + 2.0*p, 1.0 + 4.0*p,
+                                    3.0 + 2.0*p, 5.0]
+        self.__increments = [0.0, p/2.0, p, (1.0 + p)/2.0, 1.0]
+
+    def __parabolic(self, i, d):
+        heights = self.__heights
+        positions = self.__positions
+
+        return heights[i] + d / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + d)
+            * (heights[i + 1] - heights[i])
+            / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - d)
+            * (heights[i] - heights[i - 1])
+            / (positions[i] - positions[i - 1]))
+
+    def __linear(self, i, d):
+        heights = self.__heights
+        positions = self.__positions
+
+        return heights[i] + d * (heights[i + d] - heights[i]) / \
+            (positions[i + d] - positions[i])
+
+    def add(self, value):
+        heights = self.__heights
+
+        if len(heights) < 5:
+            insort(heights, value)
+            return
+
+        # cell k of the markers that the value falls into
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = bisect_right(heights, value) - 1
+
+        positions = self.__positions
+        desired_positions = self.__desired_positions
+
+        for i in range(k + 1, 5):
+            positions[i] += 1
 
-        return packets
+        for i in range(5):
+            desired_positions[i] += self.__increments[i]
+
+        # move the middle markers by one position towards where they belong
+        for i in range(1, 4):
+            d = desired_positions[i] - positions[i]
+
+            if (d >= 1.0 and positions[i + 1] - positions[i] > 1) \
+                    or (d <= -1.0 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0.0 else -1
+                height = self.__parabolic(i, d)
+
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self.__linear(i, d)
+
+                heights[i] = height
+                positions[i] += d
+
+    @property
+    def value(self):
+        heights = self.__heights
+
+        if not heights:
+            return math.nan
+
+        # exact nearest-rank quantile of the first few samples
+        if len(heights) < 5:
+            return heights[min(int(self.__p * len(heights)), len(heights) - 1)]
+
+        return heights[2]
+
+
+# node metrics
+# opt-in per-node success and drop counters and access delay sketches, fed
+# by the engines on every success and every packet dropped after too many
+# collisions; the access delay of a packet runs from when it reaches the
+# head of its node queue to the start of its successful transmission
+class NodeMetrics:
+    QUANTILES = [0.5, 0.9, 0.99]
+
+    def __init__(self, node_num):
+        self.__successful_packets = [0] * node_num
+        self.__dropped_packets = [0] * node_num
+        self.__access_delay_sum = 0.0
+        self.__access_delay_max = 0.0
+        self.__access_delay_quantiles = [
+            P2Quantile(p) for p in NodeMetrics.QUANTILES]
+
+    def transmission_success(self, k, access_delay):
+        self.__successful_packets[k] += 1
+        self.__access_delay_sum += access_delay
+
+        if access_delay > self.__access_delay_max:
+            self.__access_delay_max = access_delay
+
+        for quantile in self.__access_delay_quantiles:
+            quantile.add(access_delay)
+
+    def packet_dropped(self, k):
+        self.__dropped_packets[k] += 1
+
+    def metrics(self):
+        successful_packets = sum(self.__successful_packets)
+        squares = sum(count * count for count in self.__successful_packets)
+
+        metrics = {
+            "access_delay_avg": self.__access_delay_sum / successful_packets
+            if successful_packets else math.nan,
+            "access_delay_max": self.__access_delay_max
+        }
+
+        for p, quantile in zip(NodeMetrics.QUANTILES,
+                               self.__access_delay_quantiles):
+            metrics["access_delay_p%g" % (100 * p)] = quantile.value
+
+        metrics.update({
+            "dropped_packets": sum(self.__dropped_packets),
+            # Jain's index of the per-node throughputs, 1 when all nodes get
+            # the same share and 1/n when a single node gets everything
+            "fairness_index": successful_packets**2
+            / (len(self.__successful_packets) * squares) if squares else 1.0,
+            "successful_packets_per_node": list(self.__successful_packets),
+            "dropped_packets_per_node": list(self.__dropped_packets)
+        })
+
+        return metrics
 
 
 # node
 class Node:
     __BACKOFF_MAX = 10
 
-    def __init__(self, id, packets, trans_rate, trans_delay, prop_delay, is_persistent):
+    def __init__(self, id, packets, trans_rate, trans_delay, prop_delay,
+                 is_persistent, random_stream, metrics=None):
         self.__id = id
-        self.__packets = packets
+        # only the first packet is held, the rest are pulled on demand
+        self.__packets = iter(packets)
+        self.__first_packet_arrival_time = next(self.__packets, float("inf"))
         self.__trans_rate = trans_rate
         self.__trans_delay = trans_delay
         self.__prop_delay = prop_delay
         self.__is_persistent = is_persistent
         self.__collision_counter = 0
-        self.__wait_counter = 0
+        self.__sensing_retry_counter = 0
         self.__updated_arrival_time = -1.0
+        self.__random_stream = random_stream
+        # detailed metrics, and when the first packet reached the head of
+        # the queue
+        self.__metrics = metrics
+        self.__head_time = self.__first_packet_arrival_time
 
-    @staticmethod
-    def __generate_backoff_random(k):
-        return random.randint(0, 2**k - 1)
+    def __generate_backoff_random(self, k):
+        return self.__random_stream.randbelow(2**k)
 
     def __calculate_collision_backoff_time(self):
         self.__collision_counter += 1
 
         if self.__collision_counter > Node.__BACKOFF_MAX:
-            self.__pop_and_reset()
+            if self.__metrics is not None:
+                drop_time = self.updated_first_packet_arrival_time
+                self.__metrics.packet_dropped(self.__id)
+                self.__pop_and_reset()
+                self.__head_time = max(
+                    self.__first_packet_arrival_time, drop_time)
+            else:
+                self.__pop_and_reset()
 
             return None
 
-        r = Node.__generate_backoff_random(self.__collision_counter)
-        backoff_interval = r * 512 / self.__trans_rate
-
-        return backoff_interval
-
-    def __calculate_wait_backoff_time(self):
-        if self.__wait_counter < Node.__BACKOFF_MAX:
-            self.__wait_counter += 1
-
-        r = Node.__generate_backoff_random(self.__wait_counter)
+        r = self.__generate_backoff_random(self.__collision_counter)
         backoff_interval = r * 512 / self.__trans_rate
 
         return backoff_interval
@@ -80,14 +512,14 @@ class Node:
         self.__popleft_packet()
 
     def __popleft_packet(self):
-        return self.__packets.popleft()
+        first_packet_arrival_time = self.__first_packet_arrival_time
+        self.__first_packet_arrival_time = next(self.__packets, float("inf"))
+
+        return first_packet_arrival_time
 
     def __reset_collision_counter(self):
         self.__collision_counter = 0
 
-    def __reset_wait_counter(self):
-        self.__wait_counter = 0
-
     def __calculate_total_prop_delay(self, node_id):
         return abs(self.__id - node_id) * self.__prop_delay
 
@@ -102,14 +534,19 @@ class Node:
             self.__updated_arrival_time = max(
                 self.updated_first_packet_arrival_time, busy_end_time)
         else:
-            # non-persistent mode and not sender node
-            while True:
-                if self.updated_first_packet_arrival_time < busy_end_time:
-                    backoff_interval = self.__calculate_wait_backoff_time()
-                    self.__updated_arrival_time = self.updated_first_packet_arrival_time + backoff_interval
-                else:
-                    self.__reset_wait_counter()
-                    break
+            # non-persistent mode and not sender node, sense the bus until it
+            # is free again in one draw
+            gap = busy_end_time - self.updated_first_packet_arrival_time
+
+            if gap > 0.0:
+                backoff_slots, retries = SensingBackoff.sample(
+                    self.__random_stream,
+                    math.ceil(gap * self.__trans_rate / 512),
+                    Node.__BACKOFF_MAX)
+                self.__updated_arrival_time = \
+                    self.updated_first_packet_arrival_time + \
+                    backoff_slots * 512 / self.__trans_rate
+                self.__sensing_retry_counter += retries
 
     def check_collision(self, node_id, current_sim_time):
         is_colliding = False
@@ -132,20 +569,177 @@ class Node:
             self.__updated_arrival_time = self.updated_first_packet_arrival_time + backoff_interval
 
     def transmission_success(self):
-        self.__pop_and_reset()
+        if self.__metrics is not None:
+            success_time = self.updated_first_packet_arrival_time
+            self.__metrics.transmission_success(
+                self.__id, success_time - self.__head_time)
+            self.__pop_and_reset()
+            # the next packet waits for this one to leave the bus
+            self.__head_time = max(self.__first_packet_arrival_time,
+                                   success_time + self.__trans_delay)
+        else:
+            self.__pop_and_reset()
 
     @property
     def id(self):
         return self.__id
 
+    @property
+    def sensing_retry_counter(self):
+        return self.__sensing_retry_counter
+
     @property
     def updated_first_packet_arrival_time(self):
-        return max(self.__updated_arrival_time, self.__packets[0]) if len(self.__packets) > 0 else float("inf")
+        # no packet left means an infinite first packet arrival time
+        return max(self.__updated_arrival_time,
+                   self.__first_packet_arrival_time)
+
+
+# bus
+# same behaviour as a list of Node objects, but the state of all nodes is
+# kept in flat per-node lists and the attempt time of every node is stored
+# already resolved against its first packet
+class Bus:
+    __BACKOFF_MAX = 10
+
+    def __init__(self, packets_list, trans_rate, trans_delay, prop_delay,
+                 is_persistent, random_streams, metrics=None):
+        node_num = len(packets_list)
+
+        self.__packets_list = [iter(packets) for packets in packets_list]
+        self.__first_packet_arrival_times = [
+            next(packets, float("inf")) for packets in self.__packets_list]
+        self.__trans_rate = trans_rate
+        self.__trans_delay = trans_delay
+        self.__is_persistent = is_persistent
+        self.__random_streams = random_streams
+        # propagation delay between two nodes k positions apart
+        self.__prop_delays = [k * prop_delay for k in range(node_num)]
+        self.__collision_counters = [0] * node_num
+        self.__sensing_retry_counter = 0
+        self.__updated_arrival_times = [-1.0] * node_num
+        self.__attempt_times = [0.0] * node_num
+        self.__metrics = metrics
+        self.__head_times = list(self.__first_packet_arrival_times)
+
+        for k in range(node_num):
+            self.__update_attempt_time(k)
+
+    def __update_attempt_time(self, k):
+        self.__attempt_times[k] = max(self.__updated_arrival_times[k],
+                                      self.__first_packet_arrival_times[k])
+
+        return self.__attempt_times[k]
+
+    def __calculate_backoff_interval(self, k, counter):
+        r = self.__random_streams[k].randbelow(2**counter)
+
+        return r * 512 / self.__trans_rate
+
+    def __pop_and_reset(self, k):
+        self.__collision_counters[k] = 0
+        self.__first_packet_arrival_times[k] = next(
+            self.__packets_list[k], float("inf"))
+
+    def colliding_nodes(self, sender_id, current_sim_time, node_ids):
+        attempt_times = self.__attempt_times
+        prop_delays = self.__prop_delays
+
+        return [k for k in node_ids if k != sender_id and attempt_times[k]
+                <= current_sim_time + prop_delays[abs(k - sender_id)]]
+
+    def reschedule_collision(self, k):
+        self.__collision_counters[k] += 1
+
+        if self.__collision_counters[k] > Bus.__BACKOFF_MAX:
+            if self.__metrics is not None:
+                self.__metrics.packet_dropped(k)
+                self.__pop_and_reset(k)
+                self.__head_times[k] = max(self.__first_packet_arrival_times[k],
+                                           self.__attempt_times[k])
+            else:
+                self.__pop_and_reset(k)
+        else:
+            self.__updated_arrival_times[k] = self.__attempt_times[k] + \
+                self.__calculate_backoff_interval(
+                    k, self.__collision_counters[k])
+
+        return self.__update_attempt_time(k)
+
+    def reschedule_busy_bus(self, k, sender_id, current_sim_time):
+        busy_start_time = current_sim_time + \
+            self.__prop_delays[abs(k - sender_id)]
+        busy_end_time = busy_start_time + self.__trans_delay
+
+        if self.__is_persistent or k == sender_id:
+            self.__updated_arrival_times[k] = max(
+                self.__attempt_times[k], busy_end_time)
+        else:
+            gap = busy_end_time - self.__attempt_times[k]
+
+            if gap > 0.0:
+                backoff_slots, retries = SensingBackoff.sample(
+                    self.__random_streams[k],
+                    math.ceil(gap * self.__trans_rate / 512),
+                    Bus.__BACKOFF_MAX)
+                self.__updated_arrival_times[k] = self.__attempt_times[k] + \
+                    backoff_slots * 512 / self.__trans_rate
+                self.__sensing_retry_counter += retries
+
+        return self.__update_attempt_time(k)
+
+    def transmission_success(self, k):
+        if self.__metrics is not None:
+            success_time = self.__attempt_times[k]
+            self.__metrics.transmission_success(
+                k, success_time - self.__head_times[k])
+            self.__pop_and_reset(k)
+            self.__head_times[k] = max(self.__first_packet_arrival_times[k],
+                                       success_time + self.__trans_delay)
+        else:
+            self.__pop_and_reset(k)
+
+        return self.__update_attempt_time(k)
+
+    @property
+    def attempt_times(self):
+        return list(self.__attempt_times)
+
+    @property
+    def sensing_retry_counter(self):
+        return self.__sensing_retry_counter
 
 
 # simulator
 class DES:
-    def __init__(self, node_num, arrival_rate_avg, trans_rate, packet_length, node_distance, prop_speed, sim_time, is_persistent):
+    ENGINE_NODES = "nodes"
+    ENGINE_BUS = "bus"
+
+    # per-node streams are many and short lived, keep their blocks small
+    __NODE_BLOCK_SIZE = 256
+
+    # transmissions between two looks at the wall clock for checkpoints and
+    # progress reports
+    __CHECKPOINT_EVENTS = 4096
+
+    def __init__(self, node_num, arrival_rate_avg, trans_rate, packet_length,
+                 node_distance, prop_speed, sim_time, is_persistent,
+                 seed=None, engine=ENGINE_NODES, detailed_metrics=False,
+                 trace_path=None, checkpoint_path=None,
+                 checkpoint_interval=None, progress_callback=None,
+                 progress_interval=None):
+        self.__params = {
+            "node_num": node_num,
+            "arrival_rate_avg": arrival_rate_avg,
+            "trans_rate": trans_rate,
+            "packet_length": packet_length,
+            "node_distance": node_distance,
+            "prop_speed": prop_speed,
+            "is_persistent": is_persistent,
+            "engine": engine,
+            "detailed_metrics": detailed_metrics,
+            "trace_path": trace_path
+        }
         self.__node_num = node_num
         self.__arrival_rate_avg = arrival_rate_avg
         self.__trans_rate = trans_rate
@@ -154,11 +748,105 @@ class DES:
         self.__prop_delay = node_distance/prop_speed
         self.__sim_time = sim_time
         self.__is_persistent = is_persistent
+        self.__random_stream = RandomStream(seed)
+        self.__engine = engine
+        # access delays, drops and fairness cost a little per transmission,
+        # so they are only collected on request
+        self.__is_detailed = detailed_metrics
+        # replay the packets of a trace instead of Poisson arrivals
+        self.__trace_path = trace_path
+        self.__checkpoint_path = checkpoint_path
+        # checkpoints, progress reports and phase times of the event loop
+        self.__run_control = RunControl(
+            sim_time, DES.__count_events,
+            None if checkpoint_path is None else self.__save_checkpoint,
+            checkpoint_interval, progress_callback, progress_interval)
+        # event loop state, restored by resume
+        self.__state = None
 
-    def __generate_nodes(self):
-        pg = PacketsGenerator(self.__arrival_rate_avg, self.__sim_time)
+    @staticmethod
+    def resume(checkpoint_path, sim_time=None, checkpoint_interval=None,
+               **options):
+        # continue an interrupted run, or extend a finished one to a longer
+        # sim_time without simulating its prefix again
+        checkpoint, sim_time = load_checkpoint(
+            checkpoint_path, ENGINE_VERSION, sim_time)
+
+        if sim_time > checkpoint["sim_time"] \
+                and checkpoint["params"]["trace_path"] is not None:
+            # the trace streams stop at the horizon of the checkpointed run
+            raise CheckpointRangeError("trace checkpoint cannot be extended")
+
+        instance = DES(sim_time=sim_time, checkpoint_path=checkpoint_path,
+                       checkpoint_interval=checkpoint_interval,
+                       **checkpoint["params"], **options)
+        # synthetic node packet streams have no horizon, so the state
+        # carries on as is
+        instance.__state = checkpoint["state"]
+
+        return instance
+
+    def __save_checkpoint(self, state):
+        save_checkpoint(self.__checkpoint_path, {
+            "engine_version": ENGINE_VERSION,
+            "params": self.__params,
+            "sim_time": self.__sim_time,
+            "state": state
+        })
+
+    @property
+    def profile(self):
+        return self.__run_control.profile
 
-        return [Node(k, pg.generate_packets(), self.__trans_rate, self.__trans_delay, self.__prop_delay, self.__is_persistent) for k in range(self.__node_num)]
+    @staticmethod
+    def __count_events(state):
+        return state["total_transmission_counter"]
+
+    def __generate_node_inputs(self):
+        # packets are not cut off at sim_time: a packet arriving just after it
+        # still collides with or defers to transmissions started before, and a
+        # resumed run with a longer sim_time continues the very same streams
+        pg = PacketsGenerator(self.__arrival_rate_avg, math.inf)
+        packets_list = []
+        backoff_randoms = []
+
+        # each node gets its own arrival and backoff streams, spawned in node
+        # order so that node k sees the same randomness for a given seed
+        for _ in range(self.__node_num):
+            arrival_random = self.__random_stream.spawn(
+                DES.__NODE_BLOCK_SIZE)
+            backoff_randoms.append(
+                self.__random_stream.spawn(DES.__NODE_BLOCK_SIZE))
+            packets_list.append(pg.stream_packets(arrival_random))
+
+        if self.__trace_path is not None:
+            # a packet arriving later cannot reach the bus before sim_time
+            horizon = self.__sim_time + \
+                (self.__node_num - 1) * self.__prop_delay + self.__trans_delay
+            demultiplexer = TraceDemultiplexer(
+                self.__trace_path, self.__node_num, horizon)
+            packets_list = [TracePackets(demultiplexer, k)
+                            for k in range(self.__node_num)]
+
+        return packets_list, backoff_randoms
+
+    def __generate_node_metrics(self):
+        return NodeMetrics(self.__node_num) if self.__is_detailed else None
+
+    def __generate_nodes(self, metrics):
+        packets_list, backoff_randoms = self.__generate_node_inputs()
+
+        return [Node(k, packets_list[k], self.__trans_rate, self.__trans_delay,
+                     self.__prop_delay, self.__is_persistent,
+                     backoff_randoms[k], metrics)
+                for k in range(self.__node_num)]
+
+    def __generate_bus(self, metrics):
+        packets_list, backoff_randoms = self.__generate_node_inputs()
+
+        return Bus(packets_list, self.__trans_rate, self.__trans_delay,
+                   self.__prop_delay, self.__is_persistent, backoff_randoms,
+                   metrics)
 
     def __calculate_metrics(self, data):
         efficiency = data["successful_transmission_counter"] / \
@@ -166,64 +854,228 @@ class DES:
         throughput = data["successful_transmission_counter"] * \
             data["packet_length"] / (data["sim_time"] * 10**6)
 
-        return {
+        metrics = {
             "is_persistent": self.__is_persistent,
             "arrival_rate_avg": self.__arrival_rate_avg,
             "node_num": self.__node_num,
             "efficiency": efficiency,
-            "throughput": throughput
+            "throughput": throughput,
+            # busy-bus sensing retries resolved without looping over them
+            "collapsed_sensing_retries": data["sensing_retry_counter"]
         }
 
-    def __process_events(self):
+        if data["node_metrics"] is not None:
+            metrics.update(data["node_metrics"].metrics())
+
+        return metrics
+
+    def __advance_nodes(self, state, deadline, end_time):
         # counter
-        total_transmission_counter = 0
-        successful_transmission_counter = 0
+        total_transmission_counter = state["total_transmission_counter"]
+        successful_transmission_counter = \
+            state["successful_transmission_counter"]
+
+        nodes = state["nodes"]
+        schedule = state["schedule"]
 
-        # generate nodes
-        nodes = self.__generate_nodes()
+        # a transmission only reaches nodes attempting before it arrives
+        max_prop_delay = (self.__node_num - 1) * self.__prop_delay
 
-        current_sim_time = 0
+        is_finished = True
+        next_check_counter = total_transmission_counter + \
+            DES.__CHECKPOINT_EVENTS
 
         while True:
-            # find the node to transmit
-            sender_node = min(
-                nodes, key=lambda n: n.updated_first_packet_arrival_time)
-            # set current sim time
-            current_sim_time = sender_node.updated_first_packet_arrival_time
+            # find the node to transmit and set current sim time
+            sender_id, current_sim_time = schedule.peek()
+            sender_node = nodes[sender_id]
 
-            if current_sim_time >= self.__sim_time:
+            if current_sim_time >= end_time:
                 break
 
+            if total_transmission_counter >= next_check_counter:
+                next_check_counter += DES.__CHECKPOINT_EVENTS
+
+                if time.time() >= deadline:
+                    is_finished = False
+                    break
+
             # start transmission
             total_transmission_counter += 1
 
             # detect and handle collision
             is_colliding = False
 
-            for node in nodes:
-                if node.id != sender_node.id:
+            for node_id in schedule.keys_at_most(
+                    current_sim_time + max_prop_delay):
+                if node_id != sender_id:
+                    node = nodes[node_id]
                     is_node_colliding = node.check_collision(
-                        sender_node.id, current_sim_time)
+                        sender_id, current_sim_time)
 
                     if is_node_colliding:
                         is_colliding = True
                         total_transmission_counter += 1
                         node.reschedule_collision()
+                        schedule.update(
+                            node_id, node.updated_first_packet_arrival_time)
 
             if is_colliding:
                 sender_node.reschedule_collision()
+                schedule.update(
+                    sender_id, sender_node.updated_first_packet_arrival_time)
             else:
                 # no collision
                 successful_transmission_counter += 1
                 sender_node.transmission_success()
+                schedule.update(
+                    sender_id, sender_node.updated_first_packet_arrival_time)
 
-                for node in nodes:
-                    node.reschedule_busy_bus(
-                        sender_node.id, current_sim_time)
+                # only nodes attempting before the bus is free again move
+                for node_id in schedule.keys_at_most(
+                        current_sim_time + max_prop_delay + self.__trans_delay):
+                    node = nodes[node_id]
+                    node.reschedule_busy_bus(sender_id, current_sim_time)
+                    schedule.update(
+                        node_id, node.updated_first_packet_arrival_time)
+
+        state["total_transmission_counter"] = total_transmission_counter
+        state["successful_transmission_counter"] = \
+            successful_transmission_counter
+        state["clock"] = current_sim_time
+
+        return is_finished
+
+    def __process_events(self):
+        state = self.__state
+
+        phase_start_time = time.perf_counter()
+
+        if state is None:
+            # generate nodes
+            node_metrics = self.__generate_node_metrics()
+            nodes = self.__generate_nodes(node_metrics)
+            phase_start_time = self.__run_control.record_phase(
+                "generation", phase_start_time)
+
+            # next transmission attempt of every node, keyed by node id
+            schedule = IndexedMinHeap(
+                node.updated_first_packet_arrival_time for node in nodes)
+            phase_start_time = self.__run_control.record_phase(
+                "heapify", phase_start_time)
+
+            state = {
+                "nodes": nodes,
+                "schedule": schedule,
+                "node_metrics": node_metrics,
+                "total_transmission_counter": 0,
+                "successful_transmission_counter": 0,
+                "clock": 0.0
+            }
+
+        self.__run_control.run_segments(self.__advance_nodes, state)
+        self.__run_control.record_phase("processing", phase_start_time)
+
+        return {
+            "successful_transmission_counter":
+            state["successful_transmission_counter"],
+            "total_transmission_counter": state["total_transmission_counter"],
+            "sensing_retry_counter": sum(
+                node.sensing_retry_counter for node in state["nodes"]),
+            "node_metrics": state.get("node_metrics"),
+            "packet_length": self.__packet_length,
+            "sim_time": self.__sim_time
+        }
+
+    def __advance_bus(self, state, deadline, end_time):
+        # counter
+        total_transmission_counter = state["total_transmission_counter"]
+        successful_transmission_counter = \
+            state["successful_transmission_counter"]
+
+        bus = state["bus"]
+        schedule = state["schedule"]
+        max_prop_delay = (self.__node_num - 1) * self.__prop_delay
+
+        is_finished = True
+        next_check_counter = total_transmission_counter + \
+            DES.__CHECKPOINT_EVENTS
+
+        while True:
+            sender_id, current_sim_time = schedule.peek()
+
+            if current_sim_time >= end_time:
+                break
+
+            if total_transmission_counter >= next_check_counter:
+                next_check_counter += DES.__CHECKPOINT_EVENTS
+
+                if time.time() >= deadline:
+                    is_finished = False
+                    break
+
+            total_transmission_counter += 1
+
+            colliding_node_ids = bus.colliding_nodes(
+                sender_id, current_sim_time,
+                schedule.keys_at_most(current_sim_time + max_prop_delay))
+
+            if colliding_node_ids:
+                total_transmission_counter += len(colliding_node_ids)
+
+                for node_id in colliding_node_ids + [sender_id]:
+                    schedule.update(
+                        node_id, bus.reschedule_collision(node_id))
+            else:
+                successful_transmission_counter += 1
+                schedule.update(
+                    sender_id, bus.transmission_success(sender_id))
+
+                for node_id in schedule.keys_at_most(
+                        current_sim_time + max_prop_delay + self.__trans_delay):
+                    schedule.update(node_id, bus.reschedule_busy_bus(
+                        node_id, sender_id, current_sim_time))
+
+        state["total_transmission_counter"] = total_transmission_counter
+        state["successful_transmission_counter"] = \
+            successful_transmission_counter
+        state["clock"] = current_sim_time
+
+        return is_finished
+
+    def __process_events_bus(self):
+        state = self.__state
+
+        phase_start_time = time.perf_counter()
+
+        if state is None:
+            node_metrics = self.__generate_node_metrics()
+            bus = self.__generate_bus(node_metrics)
+            phase_start_time = self.__run_control.record_phase(
+                "generation", phase_start_time)
+
+            schedule = IndexedMinHeap(bus.attempt_times)
+            phase_start_time = self.__run_control.record_phase(
+                "heapify", phase_start_time)
+
+            state = {
+                "bus": bus,
+                "schedule": schedule,
+                "node_metrics": node_metrics,
+                "total_transmission_counter": 0,
+                "successful_transmission_counter": 0,
+                "clock": 0.0
+            }
+
+        self.__run_control.run_segments(self.__advance_bus, state)
+        self.__run_control.record_phase("processing", phase_start_time)
 
         return {
-            "successful_transmission_counter": successful_transmission_counter,
-            "total_transmission_counter": total_transmission_counter,
+            "successful_transmission_counter":
+            state["successful_transmission_counter"],
+            "total_transmission_counter": state["total_transmission_counter"],
+            "sensing_retry_counter": state["bus"].sensing_retry_counter,
+            "node_metrics": state.get("node_metrics"),
             "packet_length": self.__packet_length,
             "sim_time": self.__sim_time
         }
@@ -238,14 +1090,36 @@ class DES:
             "Start Time:         %s\n\n"
         ) % (self.__is_persistent, self.__arrival_rate_avg, self.__node_num, start_time)
 
-        data = self.__process_events()
+        if self.__engine == DES.ENGINE_BUS:
+            data = self.__process_events_bus()
+        else:
+            data = self.__process_events()
+
+        phase_start_time = time.perf_counter()
         metrics = self.__calculate_metrics(data)
+        self.__run_control.record_phase("metrics", phase_start_time)
+        self.__run_control.counter_events = data[
+            "total_transmission_counter"]
 
         str += (
             "CSMA/CD Efficiency: %.10f\n"
             "CSMA/CD Throughput: %.10f Mbps\n\n"
         ) % (metrics["efficiency"], metrics["throughput"])
 
+        if self.__is_detailed:
+            str += (
+                "Access Delay Avg:   %.10f s\n"
+                "Access Delay P50:   %.10f s\n"
+                "Access Delay P90:   %.10f s\n"
+                "Access Delay P99:   %.10f s\n"
+                "Access Delay Max:   %.10f s\n"
+                "Dropped Packets:    %d\n"
+                "Fairness Index:     %.10f\n\n"
+            ) % (metrics["access_delay_avg"], metrics["access_delay_p50"],
+                 metrics["access_delay_p90"], metrics["access_delay_p99"],
+                 metrics["access_delay_max"], metrics["dropped_packets"],
+                 metrics["fairness_index"])
+
         end_time = datetime.now().time()
         str += (
             "End Time:           %s\n\n"
@@ -255,17 +1129,34 @@ class DES:
         return [metrics, str]
 
 
-def start_DES(lock, node_num, arrival_rate_avg, trans_rate, packet_length, node_distance, prop_speed, sim_time, is_persistent):
-    DES_instance = DES(node_num, arrival_rate_avg, trans_rate,
-                       packet_length, node_distance, prop_speed, sim_time, is_persistent)
+def start_DES(node_num, arrival_rate_avg, trans_rate, packet_length,
+              node_distance, prop_speed, sim_time, is_persistent,
+              checkpoint_dir=None, checkpoint_interval=None,
+              progress_interval=None, **options):
+    job = {"node_num": node_num, "arrival_rate_avg": arrival_rate_avg,
+           "is_persistent": is_persistent, "seed": options.get("seed")}
+    progress_options = {"progress_callback": partial(emit, "progress", job),
+                        "progress_interval": progress_interval}
+    emit("start", job, sim_time=sim_time)
+
+    if checkpoint_dir is None:
+        DES_instance = DES(node_num, arrival_rate_avg, trans_rate,
+                           packet_length, node_distance, prop_speed, sim_time,
+                           is_persistent, **options, **progress_options)
+    else:
+        DES_instance = resume_run(
+            DES.resume,
+            partial(DES, node_num, arrival_rate_avg, trans_rate,
+                    packet_length, node_distance, prop_speed, sim_time,
+                    is_persistent, **options),
+            checkpoint_dir,
+            [ENGINE_VERSION, node_num, arrival_rate_avg, trans_rate,
+             packet_length, node_distance, prop_speed, is_persistent,
+             options],
+            sim_time, checkpoint_interval, **progress_options)
     res = DES_instance.sim()
 
-    lock.acquire()
-
-    try:
-        print(res[1])
-    finally:
-        lock.release()
+    emit("result", job, metrics=res[0], report=res[1])
 
     return res[0]
 
@@ -275,7 +1166,7 @@ def write_to_csv(fields, headers, rows):
     filename = ("lab2_output_%s.csv") % (round(timestamp))
 
     with open(filename, "w") as csvfile:
-        csvwriter = csv.DictWriter(csvfile, fields)
+        csvwriter = csv.DictWriter(csvfile, fields, extrasaction="ignore")
         csvwriter.writerow(headers)
         csvwriter.writerows(rows)
 
@@ -286,23 +1177,81 @@ def write_to_csv(fields, headers, rows):
     print(str)
 
 
+def estimate_cost(point):
+    # transmissions grow with the offered load, and non-persistent nodes
+    # also keep sensing the bus
+    cost = point["node_num"] * point["arrival_rate_avg"]
+
+    return cost if point["is_persistent"] else 2 * cost
+
+
+# benchmark
+# canonical workloads with fixed seeds for run_benchmark, and the phases of
+# their profile it reports
+BENCHMARK_SEED = "benchmark"
+BENCHMARK_SIM_TIME = 20.0
+BENCHMARK_WORKLOADS = [
+    {"name": "persistent N=20 A=10 nodes", "node_num": 20,
+     "arrival_rate_avg": 10, "is_persistent": True,
+     "options": {"engine": DES.ENGINE_NODES}},
+    {"name": "persistent N=100 A=10 nodes", "node_num": 100,
+     "arrival_rate_avg": 10, "is_persistent": True,
+     "options": {"engine": DES.ENGINE_NODES}},
+    {"name": "persistent N=100 A=10 bus", "node_num": 100,
+     "arrival_rate_avg": 10, "is_persistent": True,
+     "options": {"engine": DES.ENGINE_BUS}},
+    {"name": "non-persistent N=20 A=10 nodes", "node_num": 20,
+     "arrival_rate_avg": 10, "is_persistent": False,
+     "options": {"engine": DES.ENGINE_NODES}},
+    {"name": "non-persistent N=100 A=10 nodes", "node_num": 100,
+     "arrival_rate_avg": 10, "is_persistent": False,
+     "options": {"engine": DES.ENGINE_NODES}},
+    {"name": "non-persistent N=100 A=10 bus", "node_num": 100,
+     "arrival_rate_avg": 10, "is_persistent": False,
+     "options": {"engine": DES.ENGINE_BUS}}
+]
+BENCHMARK_PHASES = ["generation", "heapify", "processing", "metrics"]
+
+
+def benchmark_workload(workload):
+    DES_instance = DES(workload["node_num"], workload["arrival_rate_avg"],
+                       1000000.0, 1500.0, 10.0, 200000000.0,
+                       BENCHMARK_SIM_TIME, workload["is_persistent"],
+                       seed=BENCHMARK_SEED, **workload["options"])
+
+    return measure_benchmark(workload["name"], DES_instance, DES_instance.sim)
+
+
 def main():
     start_time = time.time()
 
+    parser = argparse.ArgumentParser(description="CSMA/CD sweep")
+    add_sweep_arguments(parser)
+    parser.add_argument("--trace", default=None,
+                        help="replay this binary trace of little-endian "
+                        "float64 (arrival time, node) records")
+    parser.add_argument("--detailed-metrics", action="store_true",
+                        help="also report access delay quantiles, dropped "
+                        "packets and per-node fairness")
+    parser.add_argument("--engine", default=DES.ENGINE_NODES,
+                        choices=[DES.ENGINE_NODES, DES.ENGINE_BUS])
+    args = parser.parse_args()
+
+    if start_service(parser, args, benchmark_workload, BENCHMARK_WORKLOADS,
+                     BENCHMARK_PHASES, ENGINE_VERSION):
+        return
+
     trans_rate = float(1*10**6)
     packet_length = 1500.0
     node_distance = 10.0
     prop_speed = float(2*10**8)
     sim_time = 1000.0
 
-    manager = Manager()
-    lock = manager.Lock()
-    pool = Pool(8)
-
     fields = [
         "is_persistent",
         "arrival_rate_avg",
         "node_num",
+        "replications",
         "efficiency",
         "throughput"
     ]
@@ -310,22 +1259,72 @@ def main():
         "is_persistent": "Persistent Mode",
         "arrival_rate_avg": "Average Arrival Rate (packets/s)",
         "node_num": "Number of Nodes",
+        "replications": "Replications",
         "efficiency": "CSMA/CD Efficiency",
         "throughput": "CSMA/CD Throughput (Mbps)"
     }
 
+    if args.detailed_metrics:
+        fields += [
+            "access_delay_avg",
+            "access_delay_p50",
+            "access_delay_p90",
+            "access_delay_p99",
+            "access_delay_max",
+            "dropped_packets",
+            "fairness_index"
+        ]
+        headers.update({
+            "access_delay_avg": "Access Delay Avg (s)",
+            "access_delay_p50": "Access Delay P50 (s)",
+            "access_delay_p90": "Access Delay P90 (s)",
+            "access_delay_p99": "Access Delay P99 (s)",
+            "access_delay_max": "Access Delay Max (s)",
+            "dropped_packets": "Dropped Packets",
+            "fairness_index": "Jain's Fairness Index"
+        })
+
     node_num_list = [20 * (5 - k) for k in range(5)]
     arrival_rate_avg_list = [20, 10, 7]
 
-    params_list = [(lock, node_num, arrival_rate_avg, trans_rate, packet_length, node_distance, prop_speed, sim_time, is_persistent)
-                   for node_num in node_num_list for arrival_rate_avg in arrival_rate_avg_list for is_persistent in [True, False]]
-
-    async_result = pool.starmap_async(start_DES, params_list)
-
-    pool.close()
-    pool.join()
-
-    rows = sorted(async_result.get(), key=lambda row: (
+    points = [{"node_num": node_num, "arrival_rate_avg": arrival_rate_avg,
+               "is_persistent": is_persistent}
+              for node_num in node_num_list
+              for arrival_rate_avg in arrival_rate_avg_list
+              for is_persistent in [True, False]]
+
+    # the trace fixes the nodes and their arrivals, only the persistence
+    # mode is swept; the arrival rate is the measured average per node
+    if args.trace is not None:
+        summary = summarize_trace(args.trace, sim_time)
+
+        if summary["packets"] == 0:
+            parser.error("the trace has no packets before the sim time")
+
+        points = [{"node_num": summary["node_num"],
+                   "arrival_rate_avg": summary["packets"]
+                   / (summary["node_num"] * sim_time),
+                   "is_persistent": is_persistent}
+                  for is_persistent in [True, False]]
+
+    run_point = partial(start_DES, trans_rate=trans_rate,
+                        packet_length=packet_length,
+                        node_distance=node_distance, prop_speed=prop_speed,
+                        sim_time=sim_time, engine=args.engine,
+                        detailed_metrics=args.detailed_metrics,
+                        trace_path=args.trace)
+    context = {"trans_rate": trans_rate, "packet_length": packet_length,
+               "node_distance": node_distance, "prop_speed": prop_speed,
+               "sim_time": sim_time, "engine": args.engine,
+               "detailed_metrics": args.detailed_metrics, "trace": args.trace}
+
+    # the contents of the trace, not just its path
+    if args.trace is not None:
+        context["trace_digest"] = file_digest(args.trace)
+
+    rows = run_sweep(args, run_point, points, estimate_cost,
+                     ["efficiency", "throughput"], ENGINE_VERSION, context)
+    rows = sorted(rows, key=lambda row: (
         -row["is_persistent"], row["arrival_rate_avg"], row["node_num"]))
 
     write_to_csv(fields, headers, rows)